@@ -0,0 +1,94 @@
+from models import Status, Currency
+from archive import Archive, UsdRates
+import numpy as np
+
+# Bootstrap ROI simulation over the archived loan history, run once per refresh and cached in the snapshot.
+# Settled loans are [PAID] and [UNPAID] Posts, a simulated portfolio funds a random sample of them in full:
+# paid loans return their USD amount plus interest, unpaid loans return nothing.
+
+class LoanPopulation():
+    '''Every settled loan as NumPy arrays, loaded once and then resampled by every simulation'''
+    # USD amount bucket edges, a loan falls in the bucket whose lower edge it reaches
+    bucketEdges = (100.0, 250.0, 500.0, 1000.0)
+    bucketNames = ('<100', '100-250', '250-500', '500-1000', '1000+')
+
+    def __init__(self, usd: np.ndarray, paid: np.ndarray, currency: np.ndarray):
+        self.usd = usd
+        self.paid = paid
+        self.currency = currency
+        self.bucket = np.digitize(usd, self.bucketEdges)
+
+    @classmethod
+    def FromArchive(cls, archive: Archive | None = None) -> 'LoanPopulation':
+        '''Settled loans of the whole archived history, loans without a known USD value are left out'''
+        data = (archive or Archive()).Scan(('created', 'status', 'currency', 'amount'))
+        settled = (data['status'] == Status.PAID.value) | (data['status'] == Status.UNPAID.value)
+        currency = data['currency'][settled]
+        usd = data['amount'][settled] * UsdRates(currency, data['created'][settled])
+        known = usd > 0
+        return cls(usd[known], data['status'][settled][known] == Status.PAID.value, currency[known])
+
+    def __len__(self) -> int:
+        return len(self.usd)
+
+    def Groups(self) -> dict[str, dict[str, np.ndarray]]:
+        '''Masks of the loans in every breakdown, the whole population included'''
+        groups = {'all': {'all': np.ones(len(self), dtype=bool)}, 'amount': {}, 'currency': {}}
+        for i, name in enumerate(self.bucketNames):
+            groups['amount'][name] = self.bucket == i
+        for currency in Currency:
+            if currency == Currency.XXX:
+                continue
+            groups['currency'][currency.name] = self.currency == currency.value
+        return groups
+
+class ROISimulation():
+    '''Monte Carlo bootstrap of lender portfolios, vectorized over every portfolio at once'''
+    portfolios = 100_000
+    loansPerPortfolio = 20
+    interest = 0.2   # Interest a lender asks on top of the principal
+    chunk = 25_000   # Portfolios sampled at a time, bounds memory to chunk * loansPerPortfolio indexes
+    seed = 0         # Fixed, so the same history always gives the same result
+
+    def __init__(self, population: LoanPopulation):
+        self.population = population
+        self.rng = np.random.default_rng(self.seed)
+
+    def PortfolioROI(self, mask: np.ndarray) -> np.ndarray:
+        '''ROI of every simulated portfolio drawn from the loans in mask'''
+        usd = self.population.usd[mask]
+        # What each loan gives back, so a portfolio is two gathers and two row sums
+        returned = np.where(self.population.paid[mask], usd * (1 + self.interest), 0.0)
+        roi = np.empty(self.portfolios)
+        for start in range(0, self.portfolios, self.chunk):
+            size = min(self.chunk, self.portfolios - start)
+            picks = self.rng.integers(0, len(usd), size=(size, self.loansPerPortfolio))
+            roi[start:start + size] = returned[picks].sum(axis=1) / usd[picks].sum(axis=1) - 1
+        return roi
+
+    def Summarize(self, mask: np.ndarray) -> dict:
+        '''Distribution of portfolio ROI for one group, None values if the group has no settled loans'''
+        loans = int(np.count_nonzero(mask))
+        summary = {'loans': loans, 'defaultRate': None, 'meanROI': None, 'medianROI': None,
+                   'p5ROI': None, 'p95ROI': None, 'lossProbability': None}
+        if loans == 0:
+            return summary
+
+        roi = self.PortfolioROI(mask)
+        p5, median, p95 = np.percentile(roi, (5, 50, 95))
+        summary.update({'defaultRate': round(1 - float(self.population.paid[mask].mean()), 4),
+                        'meanROI': round(float(roi.mean()), 4),
+                        'medianROI': round(float(median), 4),
+                        'p5ROI': round(float(p5), 4),
+                        'p95ROI': round(float(p95), 4),
+                        'lossProbability': round(float(np.count_nonzero(roi < 0)) / self.portfolios, 4)})
+        return summary
+
+    def Run(self) -> dict:
+        '''Summaries for the whole population, per amount bucket and per currency, shaped for the API'''
+        result = {'portfolios': self.portfolios, 'loansPerPortfolio': self.loansPerPortfolio,
+                  'interest': self.interest}
+        for breakdown, groups in self.population.Groups().items():
+            summaries = {name: self.Summarize(mask) for name, mask in groups.items()}
+            result[breakdown] = summaries['all'] if breakdown == 'all' else summaries
+        return result
@@ -1,49 +1,147 @@
-from fastapi import FastAPI, Response, BackgroundTasks
-from fastapi.responses import JSONResponse
-from fastapi.encoders import jsonable_encoder
+from fastapi import FastAPI, Request, Response, Query
 from pydantic import BaseModel
-from loan_data_visualizer import UpdateTimeframeData
-from os import getenv
-from dotenv import load_dotenv
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Literal
+from response_cache import SerializedResponse
+from snapshot import TimeframeSnapshot
+from rollup import RollupCube
+from refresh_job import RefreshJob
+from snapshot_file import SnapshotFile, WriteSnapshotFile
+import metrics
+import settings
+import sys
+from time import time
 
 class ChallengeCode(BaseModel):
     code: str
 
-if not load_dotenv('.env'):
+config = settings.Get()
+if not config.envFileLoaded:
     raise SystemExit("api_server.py could not open .env, exiting...")
 
-if getenv("API_SERVER_CHALLENGECODE") == None:
+if config.challengeCode == None:
     raise SystemExit("API_SERVER_CHALLENGECODE not set, exiting...")
 
-app = FastAPI(docs_url=None, redoc_url=None)
+@asynccontextmanager
+async def Lifespan(app: FastAPI):
+    '''Serving starts right away from the last published snapshot, the database pool is only opened by the first refresh'''
+    snapshot, _ = Published()
+    if snapshot.builtAt > 0:
+        print(f"Serving snapshot version {app.state.snapshotFile.version}, {time() - snapshot.builtAt:.0f} seconds old")
+    yield
+    app.state.refreshJob.Shutdown()
+    if 'db_api' in sys.modules:
+        sys.modules['db_api'].ClosePool()
+
+app = FastAPI(docs_url=None, redoc_url=None, lifespan=Lifespan)
+
+# Timeframe is serialized once per refresh, not once per request.
+# The snapshot and its response are published together as one tuple, so a refresh swaps both with a single assignment.
+# Refreshes publish to a snapshot file, which every worker process picks up on its next request.
+# The snapshot file outlives restarts and deploys, a new server serves the last good refresh from its first request.
+app.state.published = (TimeframeSnapshot([], RollupCube([]), builtAt=0), SerializedResponse([]))
+app.state.snapshotFile = SnapshotFile()
+app.state.refreshJob = RefreshJob()
+app.state.lastRevalidate = 0.0
+app.state.servedSnapshot = None
+
+# Seconds between attempts to start a refresh for a stale snapshot, another worker may already be running one
+revalidateInterval = 60.0
+
+def Published() -> tuple[TimeframeSnapshot, SerializedResponse]:
+    '''Latest snapshot published by any worker, or an empty one before the first refresh'''
+    published = app.state.snapshotFile.Current() or app.state.published
+    if published[0] is not app.state.servedSnapshot:
+        # Responses cached for the previous snapshot would keep it, and all of its cubes, in memory until evicted
+        app.state.servedSnapshot = published[0]
+        QueryRollup.cache_clear()
+        RoiResponse.cache_clear()
+    Revalidate(published[0])
+    return published
+
+def Revalidate(snapshot: TimeframeSnapshot) -> None:
+    '''Stale-while-revalidate: keep serving the snapshot, but refresh it in the background once it is older than
+       SNAPSHOT_MAX_AGE. Only the request that notices costs anything, and at most once per revalidateInterval.'''
+    now = time()
+    if config.snapshotMaxAge is None or now - snapshot.builtAt < config.snapshotMaxAge:
+        return
+    if now - app.state.lastRevalidate < revalidateInterval:
+        return
+    app.state.lastRevalidate = now
+    if app.state.refreshJob.Start(UpdateTimeframeJob, PublishTimeframe):
+        print("Snapshot is stale, refreshing in the background")
 
 # Public endpoint for getting data in cache
 @app.get("/get-timeframe")
-def GetTimeframe():
-    try: app.state.timeframeCache != None
-    except AttributeError: return JSONResponse(jsonable_encoder([]))    
-    return JSONResponse(jsonable_encoder(app.state.timeframeCache))
-
-# Private method for starting data caching
-def StartUpdateTimeframeJob():
-    '''Background job to create a new Timeframe'''
-    print(f"Lock state: {app.state.timeframeLock}")
-    app.state.timeframeCache = UpdateTimeframeData()
-    app.state.timeframeLock = False
-    print(f"Lock state: {app.state.timeframeLock}")
+def GetTimeframe(request: Request):
+    _, timeframeResponse = Published()
+    return timeframeResponse.Respond(request)
+
+@lru_cache(maxsize=256)
+def QueryRollup(snapshot: TimeframeSnapshot, start: int | None, end: int | None, bucket: str,
+                subreddit: str | None = None) -> SerializedResponse:
+    '''Serialized range query, cached for the snapshot being served, see Published()'''
+    cube = snapshot.cube if subreddit is None else snapshot.subreddits[subreddit]
+    return SerializedResponse(cube.Query(start, end, bucket))
+
+# Public endpoint for any range and granularity of the cached data, e.g. /timeframe?from=1700000000&bucket=week
+# Every crawled subreddit combined, or a single one with e.g. &subreddit=borrow
+@app.get("/timeframe")
+def GetTimeframeRange(request: Request,
+                      start: int | None = Query(None, alias="from"),
+                      end: int | None = Query(None, alias="to"),
+                      bucket: Literal['hour', 'day', 'week'] = 'day',
+                      subreddit: str | None = None):
+    snapshot, _ = Published()
+    if subreddit is not None and subreddit not in snapshot.subreddits:
+        return Response("404\n", 404)
+    return QueryRollup(snapshot, start, end, bucket, subreddit).Respond(request)
+
+@lru_cache(maxsize=4)
+def RoiResponse(snapshot: TimeframeSnapshot) -> SerializedResponse:
+    return SerializedResponse(snapshot.roi)
+
+# Public endpoint for the simulated lender ROI, overall and per amount bucket and currency, computed by the refresh
+@app.get("/roi")
+def GetROI(request: Request):
+    snapshot, _ = Published()
+    return RoiResponse(snapshot).Respond(request)
+
+# Prometheus-style metrics of this server process: refresh stages, database statements and Reddit Data API calls
+@app.get("/metrics")
+def Metrics():
+    return Response(metrics.Render(), media_type="text/plain; version=0.0.4")
+
+# Private methods for starting data caching
+def UpdateTimeframeJob(progress) -> int:
+    '''Background job to create a new Timeframe, fully built and serialized before it is published'''
+    # The crawler and database stack are only imported once a refresh runs, serving cached data never needs them
+    import db_api
+    from loan_data_visualizer import UpdateTimeframeSnapshot
+    db_api.OpenPool()
+    snapshot = UpdateTimeframeSnapshot(incremental=config.incrementalIngest, progress=progress)
+    progress('publish')
+    return WriteSnapshotFile(snapshot, SerializedResponse(snapshot.timeframe), app.state.snapshotFile.path)
+
+def PublishTimeframe(version: int) -> None:
+    '''Every worker swaps in the new file on its next request, requests already being served keep the one they started with'''
+    print(f"Published snapshot version {version}")
 
 # Public endpoint for starting the data caching, if the correct password is provided.
 # This is intended to be used with a cronjob to start at certain times of the day,
 @app.post("/update-timeframe")
-def UpdateTimeframe(challengeCode: ChallengeCode, background_tasks: BackgroundTasks):
-    try: app.state.timeframeLock != None
-    except AttributeError:
-        app.state.timeframeLock = False
-        app.state.timeframeCache = []
-    if challengeCode.code != getenv("API_SERVER_CHALLENGECODE"):
+def UpdateTimeframe(challengeCode: ChallengeCode):
+    if challengeCode.code != config.challengeCode:
         return Response("403\n", 403)
-    if app.state.timeframeLock == True:
+    if not app.state.refreshJob.Start(UpdateTimeframeJob, PublishTimeframe):
         return Response("409\n", 409)
-    app.state.timeframeLock = True
-    background_tasks.add_task(StartUpdateTimeframeJob)
-    return Response("202\n", 202)
\ No newline at end of file
+    return Response("202\n", 202)
+
+# Public endpoint for the state of the refresh, whichever server process runs it
+@app.get("/update-timeframe/status")
+def UpdateTimeframeStatus():
+    snapshot, _ = Published()
+    return app.state.refreshJob.Status() | {'snapshotVersion': app.state.snapshotFile.version,
+                                            'snapshotBuiltAt': snapshot.builtAt or None,
+                                            'subreddits': sorted(snapshot.subreddits)}
\ No newline at end of file
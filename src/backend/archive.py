@@ -0,0 +1,184 @@
+from models import Status, Currency
+from datetime import date, datetime, timedelta
+from tempfile import gettempdir
+from functools import lru_cache
+import numpy as np
+import shutil
+import os
+import db_api
+import settings
+
+# Append-only archive of anonymized Posts, one directory per day and one .npy file per column:
+#   <ARCHIVE_DIR>/day=2026-10-17/{created,status,currency,amount,isActive}.npy
+# Scans only open the columns and days they need, memory-mapped, so years of history stay cheap to query.
+
+columns = {'created': np.int64,  # Stored wall-clock time in seconds, the same clock DailyStats groups days by
+           'status': np.int8,    # Status value
+           'currency': np.int8,  # Currency value
+           'amount': np.int64,
+           'isActive': np.int8}  # -1 unknown, 0 False, 1 True, like PostBatch
+
+statusCodes = {s.name: s.value for s in Status}
+currencyCodes = {c.name: c.value for c in Currency}
+
+def ArchivePath() -> str:
+    return settings.Get().archiveDir or os.path.join(gettempdir(), 'loan-archive')
+
+@lru_cache(maxsize=1)
+def RateTable() -> dict[int, tuple[np.ndarray, np.ndarray]]:
+    '''Exchange rates per Currency value, as (valid from in seconds, usd) arrays'''
+    table = {}
+    for currency, dated in db_api.ReadExchangeRates(db_api.Database.exchangeRatesPath).items():
+        starts = np.array([d for d, _ in dated], dtype='datetime64[s]').astype(np.int64)
+        table[currencyCodes[currency]] = (starts, np.array([usd for _, usd in dated]))
+    return table
+
+def UsdRates(currency: np.ndarray, created: np.ndarray) -> np.ndarray:
+    '''USD value of one unit for every Post, the rate valid at its time. Unknown currencies get 0, like the database.'''
+    rates = np.zeros(len(currency))
+    for code, (starts, usd) in RateTable().items():
+        mask = currency == code
+        if mask.any():
+            # The first rate also applies before its date, as in Database.LoadExchangeRates
+            index = np.maximum(np.searchsorted(starts, created[mask], side='right') - 1, 0)
+            rates[mask] = usd[index]
+    return rates
+
+class Archive():
+    '''Columnar, day-partitioned Post archive, with vectorized NumPy scans for the timeframe and summary questions'''
+    def __init__(self, path: str | None = None):
+        self.path = path or ArchivePath()
+
+    def Partitions(self, start: date | None = None, end: date | None = None) -> list[tuple[date, str]]:
+        '''Day partitions between start and end (inclusive), oldest first. Only directory names are read.'''
+        if not os.path.isdir(self.path):
+            return []
+        partitions = []
+        for name in os.listdir(self.path):
+            if not name.startswith('day=') or '.' in name:
+                continue
+            day = date.fromisoformat(name[4:])
+            if (start is None or day >= start) and (end is None or day <= end):
+                partitions.append((day, os.path.join(self.path, name)))
+        return sorted(partitions)
+
+    def Scan(self, names: tuple[str, ...], start: date | None = None, end: date | None = None) -> dict[str, np.ndarray]:
+        '''Only the given columns of the days between start and end, concatenated'''
+        parts = {name: [] for name in names}
+        for _, directory in self.Partitions(start, end):
+            for name in names:
+                parts[name].append(np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r'))
+        return {name: np.concatenate(arrays) if arrays else np.empty(0, dtype=columns[name])
+                for name, arrays in parts.items()}
+
+    def Export(self, db: 'db_api.Database', firstDay: date) -> int:
+        '''Write every day from firstDay onwards from the (anonymized) Posts table, replacing those partitions.
+           Earlier days are never touched, firstDay should be the first day the crawl covered completely.
+           Returns the number of Posts written.'''
+        rows = db.GetArchiveRows(datetime.combine(firstDay, datetime.min.time()))
+        os.makedirs(self.path, exist_ok=True)
+        written = set()
+        if len(rows) > 0:
+            timestamps, statuses, currencies, amounts, active = zip(*rows)
+            created = np.array([str(t) for t in timestamps], dtype='datetime64[us]').astype('datetime64[s]')
+            data = {'created': created.astype(np.int64),
+                    'status': self.Codes(statuses, statusCodes),
+                    'currency': self.Codes(currencies, currencyCodes),
+                    'amount': np.array(amounts, dtype=np.int64),
+                    'isActive': np.array([-1 if a is None else int(a) for a in active], dtype=np.int8)}
+
+            # Rows come sorted by time, so every day is one contiguous slice
+            days = created.astype('datetime64[D]')
+            bounds = np.concatenate(([0], np.flatnonzero(days[1:] != days[:-1]) + 1, [len(days)]))
+            for first, last in zip(bounds[:-1], bounds[1:]):
+                day = days[first].item()
+                self.WritePartition(day, {name: column[first:last] for name, column in data.items()})
+                written.add(day)
+
+        # Days in the window without any Posts left, e.g. all removed by Reddit, must not keep older data
+        for day, directory in self.Partitions(firstDay):
+            if day not in written:
+                shutil.rmtree(directory)
+        return len(rows)
+
+    @staticmethod
+    def Codes(names: tuple[str, ...], codes: dict[str, int]) -> np.ndarray:
+        '''Enum names to their values, looked up once per distinct name'''
+        unique, inverse = np.unique(np.array(names), return_inverse=True)
+        return np.array([codes[name] for name in unique], dtype=np.int8)[inverse]
+
+    def WritePartition(self, day: date, data: dict[str, np.ndarray]) -> None:
+        '''Write a day to a temporary directory and swap it in, readers see either the old or the new day'''
+        directory = os.path.join(self.path, f'day={day.isoformat()}')
+        tmpDirectory = f'{directory}.{os.getpid()}.tmp'
+        os.makedirs(tmpDirectory)
+        for name, dtype in columns.items():
+            np.save(os.path.join(tmpDirectory, f'{name}.npy'), np.ascontiguousarray(data[name], dtype=dtype))
+        if os.path.exists(directory):
+            oldDirectory = f'{directory}.{os.getpid()}.old'
+            os.replace(directory, oldDirectory)
+            os.replace(tmpDirectory, directory)
+            shutil.rmtree(oldDirectory)
+        else:
+            os.replace(tmpDirectory, directory)
+
+    def Timeframe(self, start: date, end: date) -> list[dict]:
+        '''Every data point per day between start and end, oldest first, in the shape of the API timeframe'''
+        data = self.Scan(('created', 'status', 'currency', 'amount', 'isActive'), start, end)
+        days = (end - start).days + 1
+        day = (data['created'].astype('datetime64[s]').astype('datetime64[D]') - np.datetime64(start, 'D')).astype(np.int64)
+
+        req = data['status'] == Status.REQ.value
+        active = req & (data['isActive'] == 1)
+        usd = data['amount'] * UsdRates(data['currency'], data['created'])
+        def PerDay(mask: np.ndarray, weights: np.ndarray | None = None) -> np.ndarray:
+            return np.bincount(day[mask], weights=None if weights is None else weights[mask], minlength=days)
+
+        points = {'reqCount': PerDay(req),
+                  'activeCount': PerDay(active),
+                  'reqAmount': PerDay(req, data['amount']),
+                  'activeAmount': PerDay(active, data['amount']),
+                  'loansPaid': PerDay(data['status'] == Status.PAID.value),
+                  'loansUnpaid': PerDay(data['status'] == Status.UNPAID.value),
+                  'reqAmountUSD': PerDay(req, usd),
+                  'activeAmountUSD': PerDay(active, usd)}
+
+        timeframe = []
+        for i in range(days):
+            entry = {'date': (start + timedelta(i)).isoformat()}
+            for name, values in points.items():
+                entry[name] = round(float(values[i]), 2) if name.endswith('USD') else int(values[i])
+            timeframe.append(entry)
+        return timeframe
+
+    def Summary(self, start: date | None = None, end: date | None = None, invested: float = 1000.0,
+                interest: float = 0.2) -> dict:
+        '''The README questions over any range of history: market saturation, average loan, repayment and ROI.
+           ROI assumes a lender spreads invested over loans like the archived ones, each repaid with interest or
+           lost entirely, weighted by USD amounts.'''
+        data = self.Scan(('created', 'status', 'currency', 'amount', 'isActive'), start, end)
+        usd = data['amount'] * UsdRates(data['currency'], data['created'])
+        req = data['status'] == Status.REQ.value
+        paid = data['status'] == Status.PAID.value
+        unpaid = data['status'] == Status.UNPAID.value
+
+        requested = int(np.count_nonzero(req))
+        given = int(np.count_nonzero(req & (data['isActive'] == 1)))
+        paidCount, unpaidCount = int(np.count_nonzero(paid)), int(np.count_nonzero(unpaid))
+        paidUSD, unpaidUSD = float(usd[paid].sum()), float(usd[unpaid].sum())
+        settledUSD = paidUSD + unpaidUSD
+        paidShare = paidUSD / settledUSD if settledUSD > 0 else 0.0
+
+        return {'posts': len(data['status']),
+                'loansRequested': requested,
+                'loansGiven': given,
+                'saturation': given / requested if requested > 0 else 0.0,
+                'averageRequestUSD': float(usd[req].mean()) if requested > 0 else 0.0,
+                'loansPaid': paidCount,
+                'loansUnpaid': unpaidCount,
+                'defaultRate': unpaidCount / (paidCount + unpaidCount) if paidCount + unpaidCount > 0 else 0.0,
+                'amountDefaultRate': 1.0 - paidShare if settledUSD > 0 else 0.0,
+                'invested': invested,
+                'interest': interest,
+                'expectedReturn': invested * paidShare * (1 + interest),
+                'expectedROI': paidShare * (1 + interest) - 1 if settledUSD > 0 else 0.0}
@@ -0,0 +1,170 @@
+from contextlib import redirect_stdout
+from time import perf_counter, sleep
+from tempfile import gettempdir
+import subprocess
+import shutil
+import tracemalloc
+import argparse
+import socket
+import json
+import sys
+import os
+import fake_reddit
+import db_api
+import settings
+from loan_data_visualizer import UpdateTimeframeSnapshot
+from models import ParseTitles, PostBatch
+
+# End-to-end ingestion benchmark against a local fake Reddit, e.g.
+#   python benchmark.py --posts 1000 10000 100000 --db sqlite postgres
+# Postgres is reached through .env or POSTGRES_URL, like the API server.
+
+class StageTimer():
+    '''Progress callback for UpdateTimeframeSnapshot, records wall time and peak traced memory of every stage'''
+    def __init__(self, traceMemory: bool):
+        self.traceMemory = traceMemory
+        self.stages: dict[str, dict] = {}
+        self.Begin('setup')
+
+    def __call__(self, stage: str, done: int = 0, total: int | None = None) -> None:
+        if stage != self.current:
+            self.End()
+            self.Begin(stage)
+
+    def Begin(self, stage: str) -> None:
+        self.current = stage
+        if self.traceMemory:
+            tracemalloc.reset_peak()
+        self.started = perf_counter()
+
+    def End(self) -> None:
+        seconds = perf_counter() - self.started
+        peak = tracemalloc.get_traced_memory()[1] if self.traceMemory else None
+        self.stages[self.current] = {'seconds': seconds, 'peakBytes': peak}
+
+def FreePort() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def StartFakeReddit(posts: int, latency: float) -> tuple[subprocess.Popen, str]:
+    '''Run the fake Reddit in its own process, so it does not share CPU time or traced memory with the pipeline'''
+    port = FreePort()
+    process = subprocess.Popen([sys.executable, fake_reddit.__file__, '--posts', str(posts), '--latency', str(latency),
+                                '--quota', '100000000', '--port', str(port)], stdout=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(600):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return (process, url)
+        except OSError:
+            sleep(0.05)
+    process.kill()
+    raise SystemExit("Fake Reddit did not start")
+
+def UseDatabase(backend: str) -> None:
+    db_api.ClosePool()
+    if backend == 'sqlite':
+        db_api.UseSQLite()
+    else:
+        db_api.OpenPool()
+        if db_api.pool is None:
+            raise SystemExit("Postgres could not be reached, check .env or POSTGRES_URL")
+
+def Measure(traceMemory: bool, function) -> dict:
+    '''Time a single call in isolation'''
+    if traceMemory:
+        tracemalloc.reset_peak()
+    started = perf_counter()
+    function()
+    seconds = perf_counter() - started
+    return {'seconds': seconds, 'peakBytes': tracemalloc.get_traced_memory()[1] if traceMemory else None}
+
+def Run(backend: str, posts: int, latency: float, traceMemory: bool, subreddits: int = 1) -> dict[str, dict]:
+    '''Full pipeline against a fresh fake Reddit, followed by the parse and insert steps on their own.
+       With several subreddits, every one has posts Posts and they are crawled in parallel.'''
+    UseDatabase(backend)
+    config = settings.Get()
+    config.subreddits = ['borrow'] + [f'borrow{i}' for i in range(2, subreddits + 1)]
+    # Every run validates from scratch, results cached by an earlier run would skip the API
+    config.commentCachePath = os.path.join(gettempdir(), 'loan-benchmark-comment-cache.db')
+    if os.path.exists(config.commentCachePath):
+        os.remove(config.commentCachePath)
+    config.archiveDir = os.path.join(gettempdir(), 'loan-benchmark-archive')
+    shutil.rmtree(config.archiveDir, ignore_errors=True)
+    process, url = StartFakeReddit(posts, latency)
+    config.redditAuthURL = url
+    config.redditAPIURL = url
+    try:
+        timer = StageTimer(traceMemory)
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            UpdateTimeframeSnapshot(progress=timer)
+        timer.End()
+        stages = timer.stages
+        stages['total'] = {'seconds': sum(s['seconds'] for s in stages.values()),
+                           'peakBytes': max(s['peakBytes'] for s in stages.values()) if traceMemory else None}
+
+        # Crawling parses and inserts while the next page downloads, these show what each costs alone
+        subreddit = fake_reddit.FakeSubreddit(posts)
+        titles = [post['title'] for post in subreddit.posts]
+        stages['parse only'] = Measure(traceMemory, lambda: ParseTitles(titles))
+
+        batches = []
+        for start in range(0, posts, 100):
+            batch = PostBatch()
+            for post in subreddit.posts[start:start + 100]:
+                batch.Append(post['id'], post['title'], post['created'], post['num_comments'])
+            batches.append(batch)
+        db = db_api.Database()
+        db.CreateTables(wipe=True)
+        stages['insert only'] = Measure(traceMemory, lambda: [db.InsertPostList(batch) for batch in batches])
+        db.CloseConnection()
+        return stages
+    finally:
+        process.kill()
+        process.wait()
+        db_api.ClosePool()
+
+def Report(backend: str, posts: int, stages: dict[str, dict], subreddits: int = 1) -> None:
+    print(f"\n{backend}, {posts} posts" + (f" in each of {subreddits} subreddits" if subreddits > 1 else ''))
+    print(f"  {'stage':<12} {'seconds':>9} {'posts/s':>10} {'peak MiB':>9}")
+    for stage, result in stages.items():
+        # Only the crawl itself covers every subreddit, parse and insert are timed on one
+        total = posts if stage in ('parse only', 'insert only') else posts * subreddits
+        rate = total / result['seconds'] if result['seconds'] > 0 else float('inf')
+        peak = '-' if result['peakBytes'] is None else f"{result['peakBytes'] / 2**20:.1f}"
+        print(f"  {stage:<12} {result['seconds']:>9.3f} {rate:>10.0f} {peak:>9}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time every stage of UpdateTimeframeSnapshot against a local fake Reddit')
+    parser.add_argument('--posts', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--db', nargs='+', choices=('sqlite', 'postgres'), default=['sqlite', 'postgres'])
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the fake Reddit adds to every GET')
+    parser.add_argument('--subreddits', type=int, nargs='+', default=[1],
+                        help='subreddits crawled at once, each with the given number of posts')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='skip tracemalloc, which slows allocation-heavy stages down')
+    parser.add_argument('--output', help='also write the results as JSON, to compare runs')
+    args = parser.parse_args()
+
+    # Credentials are only checked for presence, the fake accepts anything.
+    # Set on the settings, which crawl worker processes are handed, as they do not share the module state.
+    settings.Get().requireEnvFile = False
+    credentials = settings.Get().redditCredentials
+    for key in credentials:
+        if credentials[key] is None:
+            credentials[key] = 'benchmark'
+
+    if args.memory:
+        tracemalloc.start()
+    results = []
+    for backend in args.db:
+        for posts in args.posts:
+            for subreddits in args.subreddits:
+                stages = Run(backend, posts, args.latency, args.memory, subreddits)
+                Report(backend, posts, stages, subreddits)
+                results.append({'db': backend, 'posts': posts, 'subreddits': subreddits, 'stages': stages})
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
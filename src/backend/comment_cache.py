@@ -0,0 +1,74 @@
+from models import PostBatch, Status, PostKey
+from tempfile import gettempdir
+from time import time
+import sqlite3
+import os
+import metrics
+import settings
+
+class CommentCheckCache():
+    '''On-disk cache of IsPostActive results, keyed by PostKey. Survives the Posts table being recreated,
+       so a Post is only fetched again once its comment count changed or its entry expired.'''
+    defaultTTL = 7 * 86400 # Seconds
+    version = 1 # Version 0 kept the Reddit ids themselves
+
+    def __init__(self, path: str | None = None, ttl: float | None = None):
+        config = settings.Get()
+        self.path = path or config.commentCachePath or os.path.join(gettempdir(), 'loan-comment-cache.db')
+        self.ttl = ttl if ttl is not None else (config.commentCacheTTL if config.commentCacheTTL is not None else self.defaultTTL)
+        self.conn = sqlite3.connect(self.path)
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] < self.version:
+            self.conn.execute('DROP TABLE IF EXISTS CommentChecks')
+            self.conn.execute(f'PRAGMA user_version = {self.version}')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS CommentChecks(
+                                id TEXT PRIMARY KEY,
+                                comments INTEGER NOT NULL,
+                                active INTEGER NOT NULL,
+                                checkedAt REAL NOT NULL)''')
+        self.conn.commit()
+        # Comment counts of Posts that still need a check, to store alongside their results
+        self.pending: dict[str, int] = {}
+
+    def ApplyTo(self, posts: PostBatch) -> int:
+        '''Fill in isActive of unresolved [REQ] Posts from fresh cache entries with the same comment count.
+           Returns the number of Posts resolved from the cache.'''
+        unresolved = {PostKey(posts.ids[i]): i for i in range(len(posts))
+                      if posts.status[i] == Status.REQ.value and posts.isActive[i] == -1}
+        if len(unresolved) == 0:
+            return 0
+
+        rows = self.conn.execute(f"""SELECT id, comments, active FROM CommentChecks
+                                     WHERE checkedAt >= ? AND id IN ({','.join('?' * len(unresolved))})""",
+                                 (time() - self.ttl, *unresolved)).fetchall()
+        hits = 0
+        for id, comments, active in rows:
+            i = unresolved[id]
+            if posts.comments[i] == comments:
+                posts.isActive[i] = active
+                del unresolved[id]
+                hits += 1
+
+        for id, i in unresolved.items():
+            self.pending[id] = posts.comments[i]
+        metrics.commentCacheHits.Inc(hits)
+        metrics.commentCacheMisses.Inc(len(unresolved))
+        return hits
+
+    def Store(self, results: list[tuple[str, bool]]) -> None:
+        '''Remember fresh IsPostActive results, and drop expired entries'''
+        now = time()
+        keys = ((PostKey(id), active) for id, active in results)
+        rows = [(key, self.pending[key], int(active), now) for key, active in keys if key in self.pending]
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO CommentChecks VALUES (?, ?, ?, ?)", rows)
+            self.conn.execute("DELETE FROM CommentChecks WHERE checkedAt < ?", (now - self.ttl,))
+        self.pending.clear()
+
+    def Close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> 'CommentCheckCache':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.Close()
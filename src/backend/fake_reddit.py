@@ -0,0 +1,179 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from threading import Thread, Lock
+from time import time, sleep
+from zlib import crc32
+import argparse
+import random
+import json
+
+# Local stand-in for the parts of the Reddit Data API used by APITool, for benchmarks and offline development.
+# Point APITool at it with REDDIT_AUTH_URL and REDDIT_API_URL, e.g. http://127.0.0.1:8081
+
+titleTemplates = ('[REQ] (${0}) - #City, ST, USA', '[REQ] (€{0}) - #Berlin, Germany', '[REQ] (£{0}) - #Leeds, UK',
+                  '[REQ] ({0} CAD) - #Toronto, Canada', '[PAID] (/u/lender) - ${0}, on time',
+                  '[UNPAID] (/u/borrower) - ${0} overdue', '[META] Weekly discussion thread')
+
+def Base36(number: int) -> str:
+    '''Reddit style id, base 36 without leading zeroes'''
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    result = ''
+    while True:
+        number, digit = divmod(number, 36)
+        result = digits[digit] + result
+        if number == 0:
+            return result
+
+class FakeSubreddit():
+    '''Synthetic Posts, newest first, spread evenly over the given number of days.
+       idOffset keeps the ids of several subreddits apart, Reddit ids are unique across subreddits.'''
+    def __init__(self, posts: int, days: float = 29.0, seed: int = 1, idOffset: int = 0):
+        rng = random.Random(seed)
+        now = time()
+        spacing = days * 86400 / max(posts, 1)
+        self.posts = []
+        for i in range(posts):
+            id = Base36(36**5 + idOffset + i)
+            self.posts.append({'id': id,
+                               'name': f't3_{id}',
+                               'title': rng.choice(titleTemplates).format(rng.randint(5, 1500)),
+                               'created': now - i * spacing,
+                               'created_utc': now - i * spacing,
+                               'num_comments': rng.choice((0, 0, 1, 2, 3, 5, 8, 25, 120)),
+                               'author': '[deleted]' if rng.random() < 0.02 else f'user{rng.randint(1, 5000)}'})
+        self.index = {post['id']: i for i, post in enumerate(self.posts)}
+        # Roughly half the requests with comments got a loan
+        self.active = {post['id'] for post in self.posts if rng.random() < 0.5}
+
+    def Listing(self, limit: int, after: str | None) -> dict:
+        start = 0 if not after else self.index.get(after.removeprefix('t3_'), len(self.posts)) + 1
+        page = self.posts[start:start + limit]
+        nextPage = page[-1]['name'] if len(page) > 0 and start + limit < len(self.posts) else None
+        return {'kind': 'Listing', 'data': {'after': nextPage, 'dist': len(page),
+                                            'children': [{'kind': 't3', 'data': post} for post in page]}}
+
+    def Comments(self, id: str, limit: int | None = None) -> list[dict]:
+        '''Top-level comments, oldest first. Like on r/borrow, the bot comments first and a lender soon after.'''
+        post = self.posts[self.index[id]]
+        bodies = [f'Comment {i} on this request. ' * 4 for i in range(post['num_comments'])]
+        if id in self.active and len(bodies) > 0:
+            bodies[min(1, len(bodies) - 1)] = f'$loan {post["title"][:20]}'
+        children = [{'kind': 't1', 'data': {'body': body, 'author': 'loansbot', 'replies': ''}} for body in bodies[:limit]]
+        return [{'kind': 'Listing', 'data': {'children': [{'kind': 't3', 'data': post}]}},
+                {'kind': 'Listing', 'data': {'after': None, 'children': children}}]
+
+class FakeRedditServer(ThreadingHTTPServer):
+    '''Serves /api/v1/access_token, /api/v1/me, /r/<sr>/new and /r/<sr>/comments/<id>.
+       Every subreddit name has its own posts Posts, made up on its first request.
+       Every response is delayed by latency seconds, and carries x-ratelimit-* headers for a quota
+       of quota requests per window seconds. Requests over the quota get a 429, like Reddit.'''
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], posts: int = 1000, latency: float = 0.0,
+                 quota: int = 1000000, window: float = 600.0, seed: int = 1):
+        super().__init__(address, FakeRedditHandler)
+        self.posts = posts
+        self.seed = seed
+        self.subreddits: dict[str, FakeSubreddit] = {}
+        self.latency = latency
+        self.quota = quota
+        self.window = window
+        self.lock = Lock()
+        self.windowStart = time()
+        self.used = 0
+        self.requests = {'auth': 0, 'new': 0, 'comments': 0, 'limited': 0}
+
+    def Subreddit(self, name: str) -> FakeSubreddit:
+        '''Posts of a subreddit, the same for the same name and seed'''
+        with self.lock:
+            if name not in self.subreddits:
+                # Ids stay below 7 base 36 digits for up to 50M Posts per subreddit
+                key = crc32(name.lower().encode())
+                self.subreddits[name] = FakeSubreddit(self.posts, seed=self.seed + key, idOffset=key % 1000 * 50_000_000)
+            return self.subreddits[name]
+
+    def Spend(self) -> tuple[bool, int, int, float]:
+        '''Count a request against the quota, returns (allowed, used, remaining, seconds until reset)'''
+        with self.lock:
+            now = time()
+            if now - self.windowStart >= self.window:
+                self.windowStart = now
+                self.used = 0
+            self.used += 1
+            reset = self.window - (now - self.windowStart)
+            return (self.used <= self.quota, self.used, max(self.quota - self.used, 0), reset)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+class FakeRedditHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def Send(self, status: int, body, headers: dict | None = None) -> None:
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if urlsplit(self.path).path.rstrip('/') == '/api/v1/access_token':
+            self.server.requests['auth'] += 1
+            return self.Send(200, {'access_token': 'fake-token', 'token_type': 'bearer', 'expires_in': 86400})
+        self.Send(404, {'error': 404})
+
+    def do_GET(self) -> None:
+        server: FakeRedditServer = self.server
+        if server.latency > 0:
+            sleep(server.latency)
+
+        allowed, used, remaining, reset = server.Spend()
+        headers = {'x-ratelimit-used': str(used), 'x-ratelimit-remaining': f'{remaining:.1f}',
+                   'x-ratelimit-reset': str(int(reset))}
+        if not allowed:
+            server.requests['limited'] += 1
+            return self.Send(429, {'message': 'Too Many Requests', 'error': 429}, headers)
+
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        parts = [part for part in url.path.split('/') if part]
+        if parts == ['api', 'v1', 'me']:
+            return self.Send(200, {'name': 'fake'}, headers)
+        if len(parts) == 3 and parts[0] == 'r' and parts[2] == 'new':
+            server.requests['new'] += 1
+            limit = min(int(query.get('limit', ['25'])[0]), 100)
+            return self.Send(200, server.Subreddit(parts[1]).Listing(limit, query.get('after', [None])[0]), headers)
+        if len(parts) >= 4 and parts[0] == 'r' and parts[2] == 'comments' and parts[3] in server.Subreddit(parts[1]).index:
+            server.requests['comments'] += 1
+            limit = int(query['limit'][0]) if 'limit' in query else None
+            return self.Send(200, server.Subreddit(parts[1]).Comments(parts[3], limit), headers)
+        self.Send(404, {'message': 'Not Found', 'error': 404}, headers)
+
+def Start(posts: int = 1000, latency: float = 0.0, quota: int = 1000000, window: float = 600.0,
+          host: str = '127.0.0.1', port: int = 0) -> FakeRedditServer:
+    '''Serve a fake Reddit on a background thread, port 0 picks a free one. Stop it with shutdown().'''
+    server = FakeRedditServer((host, port), posts, latency, quota, window)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local stand-in for the Reddit Data API')
+    parser.add_argument('--posts', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every GET')
+    parser.add_argument('--quota', type=int, default=1000, help='requests allowed per window')
+    parser.add_argument('--window', type=float, default=600.0, help='rate-limit window in seconds')
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+
+    server = FakeRedditServer(('127.0.0.1', args.port), args.posts, args.latency, args.quota, args.window)
+    print(f"Fake Reddit with {args.posts} Posts on {server.url}")
+    server.serve_forever()
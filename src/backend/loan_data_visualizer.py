@@ -1,53 +1,190 @@
 from models import *
 import reddit_api
 import db_api
+import metrics
+import settings
+from rollup import RollupCube
+from comment_cache import CommentCheckCache
+from archive import Archive
+from analytics import LoanPopulation, ROISimulation
+from snapshot import TimeframeSnapshot
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
 from datetime import datetime, timedelta
+import multiprocessing
 
-# TODO: Apply exchange rates to currency calculations
+# Days below the high-water mark an incremental crawl reads again. A new request often only has the bot's comments,
+# so it is parsed as not given a loan, and its lender only shows up in the comments over the next days.
+lookbackDays = 3
 
-def UpdateTimeframeData() -> list[dict]:
-    '''Master function for compiling the data to cache for the API'''
-    # Initialize everything
+def NoProgress(stage: str, done: int = 0, total: int | None = None) -> None:
+    '''Default progress callback of UpdateTimeframeSnapshot, ignores every update'''
+
+def UpdateTimeframeData(incremental: bool = False, days: int = 30, maxPages: int | None = None,
+                        backfill: bool = False) -> list[dict]:
+    '''Compile the N day timeframe, see UpdateTimeframeSnapshot'''
+    return UpdateTimeframeSnapshot(incremental, days, maxPages, backfill).timeframe
+
+def UpdateTimeframeSnapshot(incremental: bool = False, days: int = 30, maxPages: int | None = None,
+                            backfill: bool = False, progress=NoProgress, subreddits: list[str] | None = None) -> TimeframeSnapshot:
+    '''Master function for compiling the data to cache for the API.
+       Incremental runs keep the Posts table between runs and only fetch Posts newer than those stored.
+       Backfill runs are incremental, but crawl as deep as the page budget allows and resume after a crash.
+       Every subreddit in SUBREDDITS is crawled unless subreddits is given, several at once by a CrawlCoordinator.
+       progress(stage, done, total) is called as each stage advances.'''
+    incremental = incremental or backfill
+    subreddits = subreddits or settings.Get().subreddits
+    
+    # Initialize everything, the connection is handed back after the database stages, also when one fails
     timeframe = []
-    api = reddit_api.APITool()
-    db = db_api.Database()
-    api.Auth()
-    db.CreateTables()
+    with ExitStack() as resources:
+        with metrics.stageSeconds.Time(stage='setup'):
+            db = resources.enter_context(db_api.Database())
+            db.CreateTables(wipe=not incremental)
+    
+        # A single subreddit is crawled right here, several each in a worker process of their own
+        if len(subreddits) == 1:
+            IngestSubreddit(subreddits[0], incremental, days, maxPages, backfill, progress)
+        else:
+            CrawlCoordinator(subreddits).Run(not db.isPG, incremental, days, maxPages, backfill, progress)
     
-    # Get data from Reddit Data API and store in database
-    nextPage = ''
-    for _ in range(3):
-        response = api.GetNewestPosts('borrow', nextPage, 5)
-        db.InsertPostList(response[0])
-        nextPage = response[1]
+        # Anonymize data
+        progress('anonymize')
+        with metrics.stageSeconds.Time(stage='anonymize'):
+            db.AnonymizeData(keepIds=incremental)
     
-    # Validate data
-    NullPosts = db.GetNullActiveLoanRequests()
-    i = 0
-    for id in NullPosts:
-        i += 1
-        db.UpdateActiveOnLoan(id, api.IsPostActive('borrow', id))
-        print(f"NullPost validation: {i} / {NullPosts.__len__()}")
+        # Append the days the stored Posts cover completely to the columnar archive, older days are kept as they are.
+        # The crawl may stop short of the timeframe, at its page budget or where Reddit's listing ends.
+        progress('archive')
+        with metrics.stageSeconds.Time(stage='archive'):
+            coverageStart = db.GetCoverageStart()
+            if coverageStart is not None:
+                firstDay = coverageStart.date() + timedelta(1)
+                if not backfill:
+                    firstDay = max(firstDay, (datetime.today() - timedelta(days)).date() + timedelta(1))
+                Archive().Export(db, firstDay)
     
-    # Anonymize data
-    db.AnonymizeData()
+        # Make timeframe from the DailyStats rollup, which is kept up to date while Posts are stored
+        progress('aggregate')
+        with metrics.stageSeconds.Time(stage='aggregate'):
+            for day, row in enumerate(db.GetDailyStats(days)):
+                result = {'date': int((datetime.today() - timedelta(day)).timestamp()),
+                          'reqCount': row[1],
+                          'activeCount': row[2],
+                          'reqAmount': row[3],
+                          'activeAmount': row[4],
+                          'loansPaid': row[5],
+                          'loansUnpaid': row[6],
+                          'reqAmountUSD': round(row[7], 2),
+                          'activeAmountUSD': round(row[8], 2)
+
+                          }
+                timeframe.append(result)
+            #print(timeframe)
+        
+            # Hourly buckets for range queries, days and weeks are derived from them without querying again.
+            # A single scan grouped by hour and subreddit, the combined cube sums the subreddits instead of scanning again.
+            cube, cubes = RollupCube.PerSubreddit(db.AggregateHourly())
+    
+    # Simulated lender returns over the whole archived history, too slow to compute on a request
+    progress('simulate')
+    with metrics.stageSeconds.Time(stage='simulate'):
+        roi = ROISimulation(LoanPopulation.FromArchive()).Run()
+    return TimeframeSnapshot(timeframe, cube, roi=roi, subreddits=cubes)
+
+def IngestSubreddit(subreddit: str, incremental: bool = False, days: int = 30, maxPages: int | None = None,
+                    backfill: bool = False, progress=NoProgress, rateLimitShare: float = 1.0) -> int:
+    '''Crawl a subreddit into the existing Posts table and validate its open loan requests.
+       rateLimitShare is the part of the Reddit quota this crawl may use. Returns the number of Posts stored.'''
+    # Every connection is closed again when the ingest ends, also when it fails
+    with ExitStack() as resources:
+        progress('connect')
+        with metrics.stageSeconds.Time(stage='connect'):
+            api = resources.enter_context(reddit_api.APITool(rateLimitShare))
+            db = resources.enter_context(db_api.Database())
+            db.UseExistingTables()
+            commentCache = resources.enter_context(CommentCheckCache())
+            api.Auth()
+            highWaterMark = db.GetHighWaterMark(subreddit) if incremental else None
+            newest = highWaterMark
     
-    # Make timeframe
-    for day in range(30):
-        query = db.LoanPaidAndDefaultRate(day) # Experiment in querying data, will probably get removed later.
-        result = {'date': int((datetime.today() - timedelta(day)).timestamp()),
-                  'reqCount': db.LoansRequestedOnDate(day),
-                  'activeCount': db.LoansGivenOnDate(day),
-                  'reqAmount': db.LoanAmountRequestedOnDate(day),
-                  'activeAmount': db.LoanAmountGivenOnDate(day),
-                  'loansPaid': query[0],
-                  'loansUnpaid': query[1]
-                  
-                  }
-        timeframe.append(result)
-    #print(timeframe)
-    db.CloseConnection()
-    return timeframe
+        # Crawl back to the start of the timeframe, or only over the Posts stored in the last lookbackDays
+        cutoff = None
+        if not backfill:
+            cutoff = (datetime.today() - timedelta(days)).timestamp()
+            if highWaterMark is not None:
+                cutoff = max(cutoff, highWaterMark - lookbackDays * 86400)
+    
+        # Get data from Reddit Data API and store each page in database while the next one downloads
+        stored = 0
+        progress('crawl', 0, maxPages)
+        with metrics.stageSeconds.Time(stage='crawl'):
+            for page, (posts, _) in enumerate(api.CrawlNewestPosts(subreddit, cutoff, maxPages, resume=incremental), 1):
+                # Posts checked on an earlier run, and not commented on since, are not fetched again
+                commentCache.ApplyTo(posts)
+                if incremental:
+                    db.UpsertPostList(posts)
+                    if posts.created:
+                        newest = max(max(posts.created), newest if newest is not None else 0)
+                else:
+                    db.InsertPostList(posts)
+                stored += len(posts)
+                metrics.postsStored.Inc(len(posts))
+                progress('crawl', page, maxPages)
+        
+            # Only move the high-water mark once the whole crawl is stored
+            if newest is not None:
+                db.SetHighWaterMark(newest, subreddit)
+    
+        # Validate data concurrently, and write every result back at once
+        with metrics.stageSeconds.Time(stage='validate'):
+            NullPosts = db.GetNullActiveLoanRequests(subreddit)
+            progress('validate', 0, len(NullPosts))
+            results = api.IsPostActiveMany(subreddit, NullPosts, lambda done, total: progress('validate', done, total))
+            db.UpdateActiveOnLoanMany(results)
+            commentCache.Store(results)
+        return stored
+
+def IngestWorker(subreddit: str, config: settings.Settings, useSQLite: bool, *args) -> tuple[int, dict]:
+    '''IngestSubreddit in a crawl worker process, which starts without any of the coordinator's state.
+       Returns the number of Posts stored, and the metrics recorded by this ingest for the coordinator to merge.'''
+    settings.current = config
+    if useSQLite:
+        db_api.UseSQLite()
+    stored = IngestSubreddit(subreddit, *args)
+    # A worker process is reused for the next subreddit, which must only hand back what it recorded itself
+    return (stored, metrics.Snapshot(clear=True))
+
+class CrawlCoordinator():
+    '''Crawls several subreddits at once, each in a worker process with an equal share of the Reddit quota.
+       Pages of a listing can only be found through the cursor of the page before, so a subreddit is never split.'''
+    maxProcesses = 4
+
+    def __init__(self, subreddits: list[str]):
+        self.subreddits = subreddits
+        self.processes = min(len(subreddits), self.maxProcesses)
+
+    def Run(self, useSQLite: bool, incremental: bool = False, days: int = 30, maxPages: int | None = None,
+            backfill: bool = False, progress=NoProgress) -> int:
+        '''Ingest every subreddit into the existing tables, returns the number of Posts stored.
+           progress('ingest', done, total) is called as subreddits finish, any failed subreddit fails the run.'''
+        # At most this many workers run at once, and they all spend the same quota
+        share = 1.0 / self.processes
+        stored = 0
+        progress('ingest', 0, len(self.subreddits))
+        # Spawned rather than forked, so no worker inherits open connections or the threads of the API server
+        with metrics.stageSeconds.Time(stage='ingest'), \
+             ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = {executor.submit(IngestWorker, sr, settings.Get(), useSQLite, incremental, days, maxPages,
+                                       backfill, NoProgress, share): sr for sr in self.subreddits}
+            for done, future in enumerate(as_completed(futures), 1):
+                posts, workerMetrics = future.result()
+                # Crawl, validate, Reddit API and database metrics of the worker, as if the crawl ran in this process
+                metrics.Merge(workerMetrics)
+                print(f"Crawled r/{futures[future]}: {posts} Posts")
+                stored += posts
+                progress('ingest', done, len(self.subreddits))
+        return stored
     
     
 if __name__ == "__main__":
@@ -0,0 +1,216 @@
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+from bisect import bisect_left
+import sys
+
+# Process-wide metrics in the Prometheus text format, served by api_server at /metrics.
+# Each server process keeps its own values, the refresh and its stages show up on the process that ran it.
+# Crawl worker processes hand theirs back with Snapshot, and the refresh merges them in.
+
+registry: list['Metric'] = []
+
+def Escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def FormatLabels(names: tuple[str, ...], values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{Escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Metric():
+    '''Base for every metric, values are kept per combination of label values'''
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelNames = labels
+        self.values: dict[tuple, object] = {}
+        self.lock = Lock()
+        registry.append(self)
+
+    def Key(self, labels: dict) -> tuple:
+        return tuple(labels[name] for name in self.labelNames)
+
+    def Render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{FormatLabels(self.labelNames, key)} {value}')
+        return lines
+
+    def Snapshot(self, clear: bool = False) -> dict[tuple, object]:
+        with self.lock:
+            values = {key: list(value) if isinstance(value, list) else value for key, value in self.values.items()}
+            if clear:
+                self.values.clear()
+        return values
+
+    def Merge(self, values: dict[tuple, object]) -> None:
+        '''Take over values from another process, the latest value of each label combination wins'''
+        with self.lock:
+            self.values.update(values)
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def Inc(self, amount: float = 1, **labels) -> None:
+        key = self.Key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def Merge(self, values: dict[tuple, float]) -> None:
+        with self.lock:
+            for key, amount in values.items():
+                self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def Set(self, value: float, **labels) -> None:
+        with self.lock:
+            self.values[self.Key(labels)] = value
+
+class Histogram(Metric):
+    kind = 'histogram'
+    # Seconds, from a fast indexed query up to a long crawl
+    defaultBuckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 1800.0)
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = defaultBuckets):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def Observe(self, value: float, **labels) -> None:
+        key = self.Key(labels)
+        with self.lock:
+            # Per bucket counts, plus +Inf, sum and count
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def Merge(self, values: dict[tuple, list]) -> None:
+        with self.lock:
+            for key, counts in values.items():
+                current = self.values.get(key)
+                self.values[key] = list(counts) if current is None else [a + b for a, b in zip(current, counts)]
+
+    @contextmanager
+    def Time(self, **labels):
+        '''Observe the duration of a with block, also when it raises'''
+        started = perf_counter()
+        try: yield
+        finally: self.Observe(perf_counter() - started, **labels)
+
+    def Render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            for key, counts in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                    lines.append(f'{self.name}_bucket{FormatLabels(self.labelNames, key, le)} {cumulative}')
+                lines.append(f'{self.name}_sum{FormatLabels(self.labelNames, key)} {counts[-2]}')
+                lines.append(f'{self.name}_count{FormatLabels(self.labelNames, key)} {counts[-1]}')
+        return lines
+
+def Render() -> str:
+    '''Every metric in the Prometheus text exposition format'''
+    lines = []
+    for metric in registry:
+        lines.extend(metric.Render())
+    return '\n'.join(lines) + '\n'
+
+def Snapshot(clear: bool = False) -> dict[str, dict]:
+    '''Values of every metric by name, picklable to hand them to another process.
+       With clear, the values are reset, so the next Snapshot only holds what was recorded since.'''
+    return {metric.name: metric.Snapshot(clear) for metric in registry}
+
+def Merge(snapshot: dict[str, dict]) -> None:
+    '''Add a Snapshot taken in another process, counters and histograms are summed and gauges take its values'''
+    for metric in registry:
+        if metric.name in snapshot:
+            metric.Merge(snapshot[metric.name])
+
+# Refresh pipeline
+stageSeconds = Histogram('refresh_stage_seconds', 'Duration of each stage of a refresh', ('stage',))
+refreshes = Counter('refresh_runs_total', 'Finished refreshes by result', ('result',))
+refreshRunning = Gauge('refresh_in_progress', 'Whether a refresh is running in this process')
+lastRefreshDuration = Gauge('refresh_last_duration_seconds', 'Duration of the last finished refresh')
+lastRefreshSuccess = Gauge('refresh_last_success_timestamp_seconds', 'Unix time the last successful refresh finished')
+postsStored = Counter('refresh_posts_stored_total', 'Posts written to the database while crawling')
+
+# Database
+queries = Histogram('db_query_seconds', 'Duration of database statements by Database method', ('method', 'backend'))
+queryRows = Counter('db_rows_total', 'Rows written by, or fetched from, database statements', ('method', 'backend'))
+
+# Reddit Data API
+apiRequests = Counter('reddit_requests_total', 'Requests sent to the Reddit Data API', ('endpoint', 'status'))
+apiSeconds = Histogram('reddit_request_seconds', 'Duration of Reddit Data API requests', ('endpoint',))
+rateLimitWait = Counter('reddit_ratelimit_wait_seconds_total', 'Time spent waiting for the rate limiter before requests')
+rateLimitRemaining = Gauge('reddit_ratelimit_remaining', 'Requests left in the current rate-limit window')
+commentBytesDownloaded = Counter('reddit_comment_bytes_downloaded_total', 'Bytes downloaded by bounded comment scans')
+commentBytesSaved = Counter('reddit_comment_bytes_saved_total', 'Bytes bounded comment scans skipped by stopping early')
+commentCacheHits = Counter('comment_cache_hits_total', 'Posts resolved from the comment-check cache instead of the API')
+commentCacheMisses = Counter('comment_cache_misses_total', 'Posts that had to be checked through the API')
+rateLimitReset = Gauge('reddit_ratelimit_reset_seconds', 'Seconds until the rate-limit window resets')
+
+def Endpoint(url: str) -> str:
+    '''Low-cardinality label for a Reddit Data API url'''
+    if '/comments/' in url:
+        return 'comments'
+    if '/new' in url:
+        return 'new'
+    if 'access_token' in url:
+        return 'auth'
+    return 'other'
+
+class InstrumentedCursor():
+    '''Wraps a DB-API cursor, timing every statement and counting its rows under the Database method that ran it'''
+    def __init__(self, cursor, backend: str):
+        self.cursor = cursor
+        self.backend = backend
+        self.method = 'unknown'
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def Run(self, function, *args):
+        # The calling Database method is the label, found without walking the whole stack
+        self.method = sys._getframe(2).f_code.co_name
+        with queries.Time(method=self.method, backend=self.backend):
+            result = function(*args)
+        if self.cursor.rowcount is not None and self.cursor.rowcount > 0:
+            queryRows.Inc(self.cursor.rowcount, method=self.method, backend=self.backend)
+        return result
+
+    def execute(self, *args):
+        return self.Run(self.cursor.execute, *args)
+
+    def executemany(self, *args):
+        return self.Run(self.cursor.executemany, *args)
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is not None and self.cursor.rowcount < 0:
+            queryRows.Inc(1, method=self.method, backend=self.backend)
+        return row
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        if self.cursor.rowcount < 0:
+            queryRows.Inc(len(rows), method=self.method, backend=self.backend)
+        return rows
+
+    @contextmanager
+    def copy(self, *args, **kwargs):
+        self.method = sys._getframe(2).f_code.co_name
+        with queries.Time(method=self.method, backend=self.backend), self.cursor.copy(*args, **kwargs) as copy:
+            yield copy
+        if self.cursor.rowcount > 0:
+            queryRows.Inc(self.cursor.rowcount, method=self.method, backend=self.backend)
@@ -1,7 +1,18 @@
 from enum import Enum
 from datetime import datetime
+from array import array
+from collections.abc import Iterator
+from functools import lru_cache
+from tempfile import gettempdir
+import secrets
+import hashlib
+import hmac
+import os
 import re
+import settings
 
+# Subreddit of Posts stored before more than one was crawled
+defaultSubreddit = 'borrow'
 
 class Status(Enum):
     '''Defines the type of post, e.g. if someone is requesting a loan'''
@@ -18,107 +29,191 @@ class Currency(Enum):
     CAD = 4
     XXX = 5 # Unknown currency, used instead of None for invalid posts
 
-class Post():
-    '''Data Model of Posts on Subreddits'''
-    status: Status
-    currency: Currency
-    amount: int = 0       # Loan principal
-    isActive: bool = None # True if someone has accepted the loan, only relevant for [REQ] posts
-    
-    def __init__(self, id:str, title:str, timestamp:float, commentsCount: int):
-        self.id = id
-        self.title = title.upper()
-        self.timestamp = datetime.fromtimestamp(timestamp)
-        self.ParsePostType()
-        self.ParseIsActive(commentsCount)
-        self.ParseCurrencyType()
-        self.ParseCurrencyAmount()
+@lru_cache(maxsize=1)
+def PostIdKey() -> bytes:
+    '''Secret of PostKey, POST_ID_KEY if set, otherwise a random key made on first use and kept in the temp dir'''
+    config = settings.Get()
+    if config.postIdKey:
+        return config.postIdKey.encode()
 
-    def ParsePostType(self) -> None:
-        '''Parse what type of post from title, e.g. [REQ], [PAID], etc.'''
-        # Lazy parsing implementation, since only 5 valid states
-        if self.title.__contains__('[REQ]'):
-            self.status = Status.REQ
-        elif self.title.__contains__('[PAID]'):
-            self.status = Status.PAID
-        elif self.title.__contains__('[UNPAID]'):
-            self.status = Status.UNPAID
-        elif self.title.__contains__('[LATE]'):
-            self.status = Status.LATE
-        else:
-            self.status = Status.INVALID
+    path = os.path.join(gettempdir(), 'loan-post-id.key')
+    if not os.path.exists(path):
+        # Written aside and linked in place, so crawl workers starting at once all end up with the same key
+        tmpPath = f'{path}.{os.getpid()}.tmp'
+        with open(os.open(tmpPath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            f.write(secrets.token_hex(32))
+        try: os.link(tmpPath, path)
+        except FileExistsError: pass
+        finally: os.remove(tmpPath)
+    with open(path) as f:
+        return f.read().strip().encode()
 
-    def ParseIsActive(self, commentCount:int) -> None:
-        '''For [REQ] Posts, do a quick check to figure out if anyone accepted the loan. 
-           For unsure [REQ] Posts, inspect comments on Post later. Assume pre-arranged to be active.'''
-        if self.status is not Status.REQ:
-            return
-        
-        if self.title.__contains__('ARRANGED') and self.title.__contains__('[REQ]'):
-            self.isActive = True
-        
-        # Automated bot always leaves 2 comments on each [REQ] Post.
-        # If no one else posted, then assume loan is not active and don't use API request.
-        elif commentCount < 3:
-            self.isActive = False
-    
-    def ParseCurrencyType(self) -> None:
-        '''Parses currency used from post title.'''
-        if self.title.__contains__('USD'):
-            self.currency = Currency.USD
+def PostKey(id:str) -> str:
+    '''Keyed hash of a Reddit Post id, stored in its place. The same id always gets the same key,
+       so Posts are still recognized between runs, but the id can not be recovered without the secret.'''
+    return hmac.new(PostIdKey(), id.encode(), hashlib.sha256).hexdigest()[:16]
 
-        # Guess if '$' means USD or CAD, assume USD by default
-        elif self.title.__contains__('$'):        
-            if self.title.__contains__(', CA)') or self.title.__contains__('CANADA'):
-                self.currency = Currency.CAD
-            else:
-                self.currency = Currency.USD
+def PostKeyFingerprint() -> int:
+    '''Identifies the secret in use, without storing anything it could be recovered from'''
+    return int(PostKey('fingerprint'), 16) >> 32
 
-        # Explicit currency assignment
-        elif self.title.__contains__('£') or self.title.__contains__('GBP'):
-            self.currency = Currency.GBP
+# Patterns used by ParseTitle, compiled once on import.
+# Post type and currency hints are found in a single scan, none of these tokens can overlap each other.
+titleTokenPattern = re.compile(r'\[(?:REQ|PAID|UNPAID|LATE)\]|USD|\$|, CA\)|CANADA|£|GBP|€|EUR|USA\)|US\)')
+datePattern = re.compile(r"(\d{1,2}/\d{1,2}/?\d{0,4}|\d{1,2}TH|\d{1,2}ND|\d{1,2}ST)")
+centsPattern = re.compile(r"([\,,.]{1}\d{1,2}[^0-9])")
+currencySymbolPattern = re.compile(r'GBP|EUR|USD|CAD|\$|€|£')
+digitsPattern = re.compile(r"\d+")
 
-        elif self.title.__contains__('€') or self.title.__contains__('EUR'):
-            self.currency = Currency.EUR
+def ParseTitle(title:str, commentsCount:int | None = None) -> tuple[Status, Currency, int, bool | None]:
+    '''Parse status, currency, loan principal and isActive from a Post title.
+       Without a comment count, isActive is only inferred from pre-arranged loans.'''
+    title = title.upper()
+    tokens = set(titleTokenPattern.findall(title))
+    
+    # Parse what type of post from title, e.g. [REQ], [PAID], etc.
+    if '[REQ]' in tokens:
+        status = Status.REQ
+    elif '[PAID]' in tokens:
+        status = Status.PAID
+    elif '[UNPAID]' in tokens:
+        status = Status.UNPAID
+    elif '[LATE]' in tokens:
+        status = Status.LATE
+    else:
+        status = Status.INVALID
+    
+    # For [REQ] Posts, do a quick check to figure out if anyone accepted the loan. Assume pre-arranged to be active.
+    # Automated bot always leaves 2 comments on each [REQ] Post, if no one else posted assume loan is not active.
+    isActive = None
+    if status is Status.REQ:
+        if 'ARRANGED' in title:
+            isActive = True
+        elif commentsCount is not None and commentsCount < 3:
+            isActive = False
+    
+    # Guess if '$' means USD or CAD, assume USD by default. Otherwise guess currency based on location.
+    if 'USD' in tokens:
+        currency = Currency.USD
+    elif '$' in tokens:
+        currency = Currency.CAD if ', CA)' in tokens or 'CANADA' in tokens else Currency.USD
+    elif '£' in tokens or 'GBP' in tokens:
+        currency = Currency.GBP
+    elif '€' in tokens or 'EUR' in tokens:
+        currency = Currency.EUR
+    elif 'USA)' in tokens or 'US)' in tokens:
+        currency = Currency.USD
+    elif ', CA)' in tokens or 'CANADA' in tokens:
+        currency = Currency.CAD
+    else:
+        # If parsing fails completely, invalidate post and discard
+        currency = Currency.XXX
+        status = Status.INVALID
+    
+    # Remove dates and cents from entry, then final commas or dots, e.g. $1,000.00 -> $1.000 -> $1000
+    text = centsPattern.sub(" ", datePattern.sub("", title))
+    text = text.replace(",", "", 1).replace(".", "", 1)
+    
+    # Try to find the ')' separated group with a currency identifier first, then fall back to the first digit group
+    start, end = 0, len(text)
+    symbol = currencySymbolPattern.search(text)
+    if symbol is not None:
+        start = text.rfind(')', 0, symbol.start()) + 1
+        end = text.find(')', symbol.end())
+        if end == -1:
+            end = len(text)
+    
+    digits = digitsPattern.search(text, start, end)
+    if digits is None:
+        amount = 0
+        status = Status.INVALID
+    else:
+        amount = int(digits.group())
+    
+    return (status, currency, amount, isActive)
 
-        ## If not explicit, try to guess currency based on location
-        elif self.title.__contains__('USA)') or self.title.__contains__('US)'):
-            self.currency = Currency.USD
-        elif self.title.__contains__(', CA)') or self.title.__contains__('CANADA'):
-            self.currency = Currency.CAD
+def ParseTitles(titles:list[str], commentsCounts:list[int] | None = None) -> list[tuple[Status, Currency, int, bool | None]]:
+    '''Batch version of ParseTitle, e.g. for backfilling historical titles'''
+    if commentsCounts is None:
+        return [ParseTitle(title) for title in titles]
+    return [ParseTitle(title, count) for title, count in zip(titles, commentsCounts)]
 
-        # If parsing fails completely, invalidate post and discard
-        else: 
-            self.currency = Currency.XXX
-            self.status = Status.INVALID
+class Post():
+    '''Data Model of Posts on Subreddits. Status and currency are stored as their Enum values,
+       and the timestamp as epoch seconds, to keep large backfills small in memory.'''
+    __slots__ = ('id', 'title', 'created', 'statusCode', 'currencyCode', 'amount', 'isActive', 'subreddit')
     
-    def ParseCurrencyAmount(self) -> None:
-        '''Make an attempt to find the correct loan principal requested
-           (or owed in case of [UNPAID] status)'''
-        
-        # Remove date from entry
-        regexDate = re.sub(r"(\d{1,2}/\d{1,2}/?\d{0,4}|\d{1,2}TH|\d{1,2}ND|\d{1,2}ST)", "", self.title)
-        # Remove comma separators from cents, e.g. $1,000.00 -> $1.000
-        regexDate = re.sub(r"([\,,.]{1}\d{1,2}[^0-9])", " ", regexDate)
-        # Remove final commas or dots, e.g. $1.000 -> $1000
-        regexDate = regexDate.replace(",", "", 1)
-        regexDate = regexDate.replace(".", "", 1)
-        
-        # Try to find group with currency identifier first, e.g. GBP|EUR|USD|CAD|$|€|£
-        for group in regexDate.split(')'):
-            if re.findall(r'GBP|EUR|USD|CAD|\$|€|£', group).__len__() != 0:
-                try:
-                    self.amount = int(re.findall(r"(\d+)", group).pop(0))
-                except (IndexError, ValueError):
-                    self.status = Status.INVALID
-                return
-            
-        # If selective parsing attempt fails, use first available digit group
-        regexAmounts = re.findall(r"(\d+)", regexDate)
-        try:
-            self.amount = int(regexAmounts.pop(0))
-        except (IndexError, ValueError): 
-            self.status = Status.INVALID
+    def __init__(self, id:str, title:str, timestamp:float, commentsCount: int, subreddit:str = defaultSubreddit):
+        self.id = id
+        self.title = title
+        self.subreddit = subreddit
+        self.created = int(timestamp)
+        status, currency, self.amount, self.isActive = ParseTitle(title, commentsCount)
+        self.statusCode = status.value
+        self.currencyCode = currency.value
+    
+    @property
+    def status(self) -> Status:
+        return Status(self.statusCode)
+    
+    @property
+    def currency(self) -> Currency:
+        return Currency(self.currencyCode)
+    
+    @property
+    def timestamp(self) -> datetime:
+        return datetime.fromtimestamp(self.created)
+    
+    def Row(self) -> tuple:
+        '''Post as a row for the Posts table, keyed by PostKey. The Reddit id comes last, it is only kept until validation.'''
+        return (PostKey(self.id), self.timestamp, self.status.name, self.currency.name, self.amount, self.isActive,
+                self.title, self.subreddit, self.id)
             
     def __str__(self):
-        return f'{self.id}, {self.status.name}, {self.currency.name}, {self.amount}, {self.title}'
\ No newline at end of file
+        return f'{self.id}, {self.status.name}, {self.currency.name}, {self.amount}, {self.title}'
+
+class PostBatch():
+    '''Columnar container of Posts, with one compact array per field instead of one object per Post.
+       isActive uses -1 for unknown, 0 for False and 1 for True. Every Post of a batch is from the same subreddit.'''
+    statusNames = {s.value: s.name for s in Status}
+    currencyNames = {c.value: c.name for c in Currency}
+    maxAmount = 2**31 - 1 # Largest amount the INTEGER column can store
+    
+    def __init__(self, subreddit:str = defaultSubreddit):
+        self.subreddit = subreddit
+        self.ids: list[str] = []
+        self.titles: list[str] = []
+        self.created = array('q')
+        self.status = array('b')
+        self.currency = array('b')
+        self.amount = array('q')
+        self.isActive = array('b')
+        self.comments = array('l')
+    
+    def Append(self, id:str, title:str, timestamp:float, commentsCount:int) -> None:
+        '''Parse and add a Post to the batch'''
+        status, currency, amount, isActive = ParseTitle(title, commentsCount)
+        
+        # Amounts too large to store can only come from a misparsed title
+        if amount > self.maxAmount:
+            status, amount = Status.INVALID, 0
+        
+        self.ids.append(id)
+        self.titles.append(title)
+        self.created.append(int(timestamp))
+        self.status.append(status.value)
+        self.currency.append(currency.value)
+        self.amount.append(amount)
+        self.isActive.append(-1 if isActive is None else int(isActive))
+        self.comments.append(commentsCount)
+    
+    def Rows(self) -> Iterator[tuple]:
+        '''Yield every Post as a row for the Posts table, like Post.Row, without building an intermediate list'''
+        for i in range(len(self.ids)):
+            active = self.isActive[i]
+            yield (PostKey(self.ids[i]), datetime.fromtimestamp(self.created[i]), self.statusNames[self.status[i]],
+                   self.currencyNames[self.currency[i]], self.amount[i], None if active == -1 else bool(active),
+                   self.titles[i], self.subreddit, self.ids[i])
+    
+    def __len__(self) -> int:
+        return len(self.ids)
\ No newline at end of file
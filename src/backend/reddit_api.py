@@ -1,35 +1,95 @@
-import requests
+import httpx
 import os
-from dotenv import load_dotenv
-from time import time, sleep
-from models import Post
+import re
+from time import time, sleep, perf_counter
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+from collections.abc import Iterator
+from contextlib import contextmanager
+from tempfile import gettempdir
+from models import PostBatch
+import metrics
+import settings
 
 # Register apps at https://www.reddit.com/prefs/apps
 
+# A comment body containing $loan, matched on the raw JSON so the listing never has to be decoded.
+# Bodies are JSON strings, so the match can not run past the closing quote into the next field.
+loanCommentPattern = re.compile(rb'"body":\s*"(?:[^"\\]|\\.)*?\$loan', re.IGNORECASE)
+
+class RateLimiter():
+    '''Thread-safe token bucket, refilled at the pace Reddit allows through the x-ratelimit-* headers.
+       Processes sharing one Reddit app each take their share of the quota, Reddit reports the same numbers to all of them.'''
+    # Requests kept in reserve, so concurrent requests in flight never exceed the quota
+    safetyMargin = 5.0
+    maxBurst = 10.0
+
+    def __init__(self, rate: float = 1.0, share: float = 1.0):
+        # Start out at a respectful 1 req/sec until Reddit reports the actual quota
+        self.share = share
+        self.rate = rate * share
+        self.capacity = 1.0
+        self.tokens = 1.0
+        self.updated = time()
+        self.lock = Lock()
+
+    def Acquire(self) -> None:
+        '''Block until a request may be sent'''
+        while True:
+            with self.lock:
+                now = time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            sleep(wait)
+
+    def Update(self, remaining: float, reset: float) -> None:
+        '''Spread the remaining quota evenly over the seconds left until the quota resets'''
+        with self.lock:
+            usable = (remaining - self.safetyMargin) * self.share
+            reset = max(reset, 1.0)
+            if usable < 1.0:
+                # Quota is spent, wait for the reset before sending anything else
+                self.tokens = min(self.tokens, 0.0)
+                self.rate = 1.0 / reset
+                self.capacity = 1.0
+            else:
+                self.rate = usable / reset
+                self.capacity = max(min(usable, self.maxBurst * self.share), 1.0)
+                self.tokens = min(self.tokens, self.capacity)
+
 class APITool():
     '''Tool for easily creating and maintaining access to Reddit's API'''
     # Config
-    loadEnvFromFile = True
-    requestTimeout = time()
+    maxWorkers = 8 # Concurrent requests used when validating Posts
+    boundedCommentScan = True # Validate Posts with IsPostActiveBounded
+    commentLimit = 100 # Oldest top-level comments requested per Post, the $loan command is usually among the first
+    drainLimit = 16 * 1024 # Bytes still read after an early match, to keep the connection reusable
 
     # Auth
     user_agent = "python:loan-data-visualizer:v1.0.0 (by /u/OverallSoup)"
     
-    def __init__(self):
+    def __init__(self, rateLimitShare: float = 1.0):
         self.GetEnv()
+        self.limiter = RateLimiter(share=rateLimitShare)
+        # Pooled session, keeps connections to Reddit alive between requests
+        self.client = httpx.Client(headers={'User-Agent': self.user_agent},
+                                   limits=httpx.Limits(max_connections=self.maxWorkers),
+                                   timeout=30.0)
         
     def GetEnv(self) -> None:
         '''Get relevant enviornment variables for connecting to '''
         
+        config = settings.Get()
         # Optionally, load from .env file instead.
-        if self.loadEnvFromFile:
-            if not load_dotenv('.env'):
+        if config.requireEnvFile:
+            if not config.envFileLoaded:
                 raise SystemExit('RedditAPI: Could not load .env file, exiting.')
                 
-        self.APIConnDetails = {'REDDIT_USERNAME': os.getenv('REDDIT_USERNAME'),
-                               'REDDIT_PASSWORD': os.getenv('REDDIT_PASSWORD'),
-                               'CLIENT_ID': os.getenv('CLIENT_ID'),
-                               'CLIENT_SECRET': os.getenv('CLIENT_SECRET')}
+        self.APIConnDetails = dict(config.redditCredentials)
         
         # Ensure all environment variables are found
         if None in self.APIConnDetails.values():
@@ -39,59 +99,78 @@ class APITool():
                     print(f'Missing {key}')
             raise SystemExit()
         
+        # Endpoints can be pointed at a local stand-in, see fake_reddit.py
+        self.authURL = config.redditAuthURL
+        self.apiURL = config.redditAPIURL
+        
         print('Env loaded!')
     
     def Auth(self) -> None:
         """Authenticate with Reddit API"""
-        client_auth = requests.auth.HTTPBasicAuth(self.APIConnDetails['CLIENT_ID'], 
-                                                  self.APIConnDetails['CLIENT_SECRET'])
+        client_auth = (self.APIConnDetails['CLIENT_ID'], self.APIConnDetails['CLIENT_SECRET'])
         post_data = {'grant_type': 'password', 
                      'username': self.APIConnDetails['REDDIT_USERNAME'], 
                      'password': self.APIConnDetails['REDDIT_PASSWORD']}
         
-        headers = {'User-Agent': self.user_agent}
-        
         try:
-            response = requests.post('https://www.reddit.com/api/v1/access_token', 
-                                 auth=client_auth, data=post_data, headers=headers)
-        except requests.HTTPError as e:
-            print(f"Something went wrong during Auth\n{e}\n{e.response.status_code}\n{e.response.json()}")
+            response = self.client.post(f'{self.authURL}/api/v1/access_token', 
+                                        auth=client_auth, data=post_data)
+        except httpx.HTTPError as e:
+            metrics.apiRequests.Inc(endpoint='auth', status='error')
+            print(f"Something went wrong during Auth\n{e}")
             raise SystemExit()
+        metrics.apiRequests.Inc(endpoint='auth', status=response.status_code)
+        if response.status_code != 200:
+            raise SystemExit(f"Reddit refused Auth with status {response.status_code}")
         
         self.access_token = response.json()['access_token']
         self.token_type = response.json()['token_type']
     
-    def GetRequest(self, url: str) -> requests.Response:
-        '''GET request with self-imposed rate-limit'''
-        
-        # Very respectful rate-limiter of 1 req/sec
-        if (self.requestTimeout) > time():
-            #print("Sleeping for 1 second")
-            sleep(1)
-        
-        self.requestTimeout = time() + 1
-        
-        try: response = requests.get(url, 
-                                     headers={'Authorization': f'{self.token_type} {self.access_token}', 
-                                              'User-Agent': self.user_agent})
-        except requests.HTTPError as e:
-            raise SystemExit(f"Something went wrong during GetRequest\n{e}\n{e.response.status_code}\n{e.response.json()}")
-        print(f"x-ratelimit-remaining: {float(response.headers['x-ratelimit-remaining'])} ", end="")
-        # This should not be possible with current rate-limiter of 1 req/sec
-        if float(response.headers['x-ratelimit-remaining']) < 5.0:
-            print(f"Rate-limit somehow exceeded, sleeping for {response.headers['x-ratelimit-reset'] + 4} seconds.")
-            self.requestTimeout = time() + 4.0 + float(response.headers['x-ratelimit-reset'])
-
+    def GetRequest(self, url: str) -> httpx.Response:
+        '''GET request, paced by a token bucket following the rate-limit Reddit reports. Safe to call from several threads.'''
+        with self.StreamRequest(url) as response:
+            response.read()
         return response
     
+    @contextmanager
+    def StreamRequest(self, url: str) -> Iterator[httpx.Response]:
+        '''Paced GET request like GetRequest, but the body is left for the caller to stream, or to stop reading early.
+           Raises httpx.HTTPStatusError on any status but 2xx, e.g. 429 or 5xx, and SystemExit if Reddit can not be reached.'''
+        waitStarted = perf_counter()
+        self.limiter.Acquire()
+        metrics.rateLimitWait.Inc(perf_counter() - waitStarted)
+        
+        endpoint = metrics.Endpoint(url)
+        try:
+            with metrics.apiSeconds.Time(endpoint=endpoint), \
+                 self.client.stream('GET', url, headers={'Authorization': f'{self.token_type} {self.access_token}'}) as response:
+                metrics.apiRequests.Inc(endpoint=endpoint, status=response.status_code)
+                
+                if 'x-ratelimit-remaining' in response.headers:
+                    remaining = float(response.headers['x-ratelimit-remaining'])
+                    reset = float(response.headers.get('x-ratelimit-reset', 60))
+                    print(f"x-ratelimit-remaining: {remaining} ", end="")
+                    metrics.rateLimitRemaining.Set(remaining)
+                    metrics.rateLimitReset.Set(reset)
+                    self.limiter.Update(remaining, reset)
+                
+                # An error body has no listing or comments, it must never be read as an empty one
+                response.raise_for_status()
+                yield response
+        except httpx.HTTPStatusError:
+            raise
+        except httpx.HTTPError as e:
+            metrics.apiRequests.Inc(endpoint=endpoint, status='error')
+            raise SystemExit(f"Something went wrong during GetRequest\n{e}")
+    
     def TestConnection(self) -> None:
         '''A small test to see if authentication worked.'''
-        self.GetRequest('https://oauth.reddit.com/api/v1/me')
+        self.GetRequest(f'{self.apiURL}/api/v1/me')
         print("TestConnection was successful!")
         
-    def GetNewestPosts(self, sr:str, nextPage="", limit=100) -> tuple[list[Post], str]:
-        '''Return latest Posts from specified Subreddit, and the key for the next page'''
-        posts: list[Post] = []
+    def GetNewestPosts(self, sr:str, nextPage="", limit=100) -> tuple[PostBatch, str]:
+        '''Return latest Posts from specified Subreddit as a PostBatch, and the key for the next page'''
+        posts = PostBatch(sr)
         
         # Limit to 100 posts, which is enforced by Reddit Data API
         c = min(limit, 100)
@@ -99,34 +178,141 @@ class APITool():
         
         # Use correct API
         if nextPage == "":
-            response = self.GetRequest(f'https://oauth.reddit.com/r/{sr}/new/?limit={c}').json()['data']
+            response = self.GetRequest(f'{self.apiURL}/r/{sr}/new/?limit={c}').json()['data']
         else:
-            response = self.GetRequest(f'https://oauth.reddit.com/r/{sr}/new/?limit={c}&after={nextPage}').json()['data']
+            response = self.GetRequest(f'{self.apiURL}/r/{sr}/new/?limit={c}&after={nextPage}').json()['data']
         
         nextPage = response['after']
         
         for child in response['children']:
             # In accordance with Reddit Data API policy, deleted users are disregarded.
             if child['data']['author'] != '[deleted]':
-                posts.append(Post(child['data']['id'], 
-                                  child['data']['title'], 
-                                  child['data']['created'],
-                                  child['data']['num_comments']))
+                posts.Append(child['data']['id'], 
+                             child['data']['title'], 
+                             child['data']['created'],
+                             child['data']['num_comments'])
         
         return (posts, nextPage)
 
+    def CrawlNewestPosts(self, sr:str, cutoff:float | None = None, maxPages:int | None = None,
+                         limit=100, resume=False) -> Iterator[tuple[PostBatch, str]]:
+        '''Yield pages of the newest Posts, following the 'after' cursor until a page reaches the cutoff (epoch),
+           the page budget is spent, or the listing ends. The next page is fetched while the current one is consumed.
+           With resume, the cursor is saved after every consumed page, and a crashed crawl continues from there.'''
+        cursorPath = f'{gettempdir()}/loan-crawl-{sr}.cursor'
+        nextPage = ''
+        if resume and os.path.exists(cursorPath):
+            with open(cursorPath) as f:
+                nextPage = f.read().strip()
+            print(f"Resuming crawl of r/{sr} from {nextPage}")
+        
+        pages = 0
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = executor.submit(self.GetNewestPosts, sr, nextPage, limit)
+            while pending is not None:
+                posts, nextPage = pending.result()
+                pages += 1
+                
+                # Decide on the next page before handing this one over, so it downloads in the meantime
+                reachedCutoff = cutoff is not None and len(posts) > 0 and min(posts.created) <= cutoff
+                if nextPage is None or reachedCutoff or (maxPages is not None and pages >= maxPages):
+                    pending = None
+                else:
+                    pending = executor.submit(self.GetNewestPosts, sr, nextPage, limit)
+                
+                yield (posts, nextPage)
+                
+                # The consumer asked for more, so the page it got has been stored
+                if resume and nextPage is not None:
+                    with open(f'{cursorPath}.tmp', 'w') as f:
+                        f.write(nextPage)
+                    os.replace(f'{cursorPath}.tmp', cursorPath)
+        
+        # Crawl finished, the next one starts from the newest Posts again
+        if resume and os.path.exists(cursorPath):
+            os.remove(cursorPath)
+
     def GetNewestPostsRaw(self) -> dict:
         '''Used for testing purposes, not for production code'''
-        return self.GetRequest(f'https://oauth.reddit.com/r/borrow/new/?limit=1').json()
+        return self.GetRequest(f'{self.apiURL}/r/borrow/new/?limit=1').json()
     
     def GetCommentsOnPostRaw(self, sr:str, id:str) -> dict:
         '''Used for testing purposes, not for production code'''
-        return self.GetRequest(f"https://oauth.reddit.com/r/{sr}/comments/{id}").json()
+        return self.GetRequest(f"{self.apiURL}/r/{sr}/comments/{id}").json()
     
     def IsPostActive(self, sr:str, id:str) -> bool:
-        response = self.GetRequest(f"https://oauth.reddit.com/r/{sr}/comments/{id}").json()
+        '''Whether a top-level comment on the Post contains $LOAN, i.e. someone gave the loan'''
+        if self.boundedCommentScan:
+            return self.IsPostActiveBounded(sr, id)
+        
+        response = self.GetRequest(f"{self.apiURL}/r/{sr}/comments/{id}").json()
         for i in response[1]['data']['children']:
             if str(i['data']['body']).upper().__contains__('$LOAN'):
                 return True
             
-        return False
\ No newline at end of file
+        return False
+    
+    def IsPostActiveBounded(self, sr:str, id:str) -> bool:
+        '''IsPostActive without downloading and decoding the whole thread: only the oldest top-level comments are
+           requested, and the body is scanned while it streams in, stopping at the first $LOAN comment.'''
+        url = f"{self.apiURL}/r/{sr}/comments/{id}?depth=1&limit={self.commentLimit}&sort=old"
+        with self.StreamRequest(url) as response:
+            buffer = b''
+            chunks = response.iter_bytes()
+            for chunk in chunks:
+                buffer += chunk
+                if loanCommentPattern.search(buffer):
+                    self.StopReading(response, chunks)
+                    return True
+                # A match can only still start at the last comment body, or in a "body" key cut off by the chunk
+                start = buffer.rfind(b'"body"')
+                buffer = buffer[start:] if start != -1 else buffer[-16:]
+            metrics.commentBytesDownloaded.Inc(response.num_bytes_downloaded)
+        
+        return False
+    
+    def StopReading(self, response: httpx.Response, chunks: Iterator[bytes]) -> None:
+        '''Stop downloading a streamed response, counting the bytes that were never downloaded'''
+        downloaded = response.num_bytes_downloaded
+        remaining = int(response.headers['content-length']) - downloaded if 'content-length' in response.headers else None
+        
+        # Closing mid-body drops the pooled connection, which costs more than reading a small remainder
+        if remaining is not None and remaining <= self.drainLimit:
+            for _ in chunks:
+                pass
+            metrics.commentBytesDownloaded.Inc(response.num_bytes_downloaded)
+            return
+        metrics.commentBytesDownloaded.Inc(downloaded)
+        if remaining is not None:
+            metrics.commentBytesSaved.Inc(remaining)
+    
+    def IsPostActiveMany(self, sr:str, ids:list[str], progress=None) -> list[tuple[str, bool]]:
+        '''Validate several Posts concurrently, returns (id, isActive) pairs in the same order as ids.
+           Posts whose comments could not be fetched are left out, so they stay unvalidated until the next run.
+           progress(done, total) is called after each Post, if given.'''
+        def Check(id: str) -> bool | None:
+            try: return self.IsPostActive(sr, id)
+            except httpx.HTTPStatusError as e:
+                print(f"Could not check Post {id}, Reddit answered {e.response.status_code}")
+                return None
+        
+        results: list[tuple[str, bool]] = []
+        with ThreadPoolExecutor(max_workers=self.maxWorkers) as executor:
+            for done, (id, active) in enumerate(zip(ids, executor.map(Check, ids)), 1):
+                if active is not None:
+                    results.append((id, active))
+                print(f"NullPost validation: {done} / {ids.__len__()}")
+                if progress is not None:
+                    progress(done, len(ids))
+        
+        return results
+    
+    def CloseConnection(self) -> None:
+        '''Close the pooled HTTP session'''
+        self.client.close()
+
+    def __enter__(self) -> 'APITool':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.CloseConnection()
\ No newline at end of file
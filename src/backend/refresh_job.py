@@ -0,0 +1,157 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from threading import Lock
+from tempfile import gettempdir
+from time import time
+import json
+import os
+import metrics
+
+# File locks only exist on Unix, elsewhere a refresh is only exclusive within one process
+try: import fcntl
+except ImportError: fcntl = None
+
+class RefreshJob():
+    '''Runs one refresh at a time on a dedicated thread, so request workers never block on it.
+       A file lock keeps several server processes from refreshing at the same time,
+       and a status file next to it lets every one of them report the refresh that is running.'''
+    lockPath = os.path.join(gettempdir(), 'loan-data-visualizer-refresh.lock')
+    statusPath = os.path.join(gettempdir(), 'loan-data-visualizer-refresh.json')
+    # Seconds between progress updates written to the status file, a new stage is always written
+    statusInterval = 1.0
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='refresh')
+        self.lock = Lock()
+        self.lockFile = None
+        self.state = 'idle'
+        self.stage = None
+        self.done = 0
+        self.total = None
+        self.startedAt = None
+        self.finishedAt = None
+        self.lastDuration = None
+        self.lastError = None
+        self.statusWritten = 0.0
+
+    def Start(self, job, onSuccess) -> bool:
+        '''Run job(progress) in the background and pass its result to onSuccess.
+           Returns False without starting anything if a refresh is already running here or in another process.'''
+        if not self.lock.acquire(blocking=False):
+            return False
+        if not self.AcquireFileLock():
+            self.lock.release()
+            return False
+
+        self.state = 'running'
+        self.stage = None
+        self.done, self.total = 0, None
+        self.startedAt = time()
+        self.WriteStatus()
+        metrics.refreshRunning.Set(1)
+        future = self.executor.submit(job, self.Progress)
+        future.add_done_callback(lambda f: self.Finish(f, onSuccess))
+        return True
+
+    def Progress(self, stage: str, done: int = 0, total: int | None = None) -> None:
+        '''Progress callback handed to the job, called from the refresh thread'''
+        newStage = stage != self.stage
+        self.stage, self.done, self.total = stage, done, total
+        if newStage or time() - self.statusWritten >= self.statusInterval:
+            self.WriteStatus()
+
+    def Finish(self, future: Future, onSuccess) -> None:
+        '''Publish the result, record timings and release the locks'''
+        try:
+            onSuccess(future.result())
+            self.state = 'idle'
+            self.lastError = None
+            metrics.refreshes.Inc(result='success')
+            metrics.lastRefreshSuccess.Set(time())
+        # The pipeline reports missing configuration with SystemExit, which must not take the server down
+        except (Exception, SystemExit) as e:
+            print(f"Refresh failed: {e!r}")
+            self.state = 'failed'
+            self.lastError = repr(e)
+            metrics.refreshes.Inc(result='failure')
+        finally:
+            self.finishedAt = time()
+            self.lastDuration = self.finishedAt - self.startedAt
+            metrics.lastRefreshDuration.Set(self.lastDuration)
+            metrics.refreshRunning.Set(0)
+            # Written while the file lock is still held, no other process can start a refresh in between
+            self.WriteStatus()
+            self.ReleaseFileLock()
+            self.lock.release()
+
+    def AcquireFileLock(self) -> bool:
+        '''Non-blocking exclusive lock shared by every server process on this machine'''
+        if fcntl is None:
+            return True
+        self.lockFile = open(self.lockPath, 'a')
+        try:
+            fcntl.flock(self.lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            self.lockFile.close()
+            self.lockFile = None
+            return False
+
+    def ReleaseFileLock(self) -> None:
+        '''Release the lock taken by AcquireFileLock, if any'''
+        if self.lockFile is not None:
+            fcntl.flock(self.lockFile, fcntl.LOCK_UN)
+            self.lockFile.close()
+            self.lockFile = None
+
+    def LockHeldElsewhere(self) -> bool:
+        '''Whether another process holds the file lock, assumed without file locks'''
+        if fcntl is None:
+            return True
+        with open(self.lockPath, 'a') as f:
+            try: fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(f, fcntl.LOCK_UN)
+            return False
+
+    def WriteStatus(self) -> None:
+        '''Publish the state of this job to every server process: write a temporary file and rename it into place'''
+        tmpPath = f'{self.statusPath}.{os.getpid()}.tmp'
+        try:
+            with open(tmpPath, 'w') as f:
+                json.dump(self.LocalStatus(), f)
+            os.replace(tmpPath, self.statusPath)
+            self.statusWritten = time()
+        except OSError as e:
+            print(f"Could not write the refresh status: {e}")
+
+    def Status(self) -> dict:
+        '''State of the last refresh of any server process on this machine, safe to serve while a refresh is running.
+           This process's own job when it is running one, or no other process published a status yet.'''
+        if self.lock.locked():
+            return self.LocalStatus()
+        try:
+            with open(self.statusPath) as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            return self.LocalStatus()
+        # The process running it exited without finishing, e.g. it was killed
+        if status.get('state') == 'running' and not self.LockHeldElsewhere():
+            status['state'] = 'failed'
+            status['lastError'] = 'The server process running the refresh exited'
+        return status
+
+    def LocalStatus(self) -> dict:
+        '''State of the job in this process'''
+        return {'state': self.state,
+                'stage': self.stage,
+                'done': self.done,
+                'total': self.total,
+                'startedAt': self.startedAt,
+                'finishedAt': self.finishedAt,
+                'lastDuration': self.lastDuration,
+                'lastError': self.lastError}
+
+    def Shutdown(self) -> None:
+        '''Wait for a running refresh to finish'''
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,59 @@
+from fastapi import Request, Response
+from hashlib import sha256
+import gzip
+import json
+
+# Brotli is optional, responses are only pre-compressed with it when installed
+try: import brotli
+except ImportError: brotli = None
+
+class SerializedResponse():
+    '''JSON response serialized and compressed once, so every request only has to pick a variant'''
+    # Data only changes when the refresh job runs, let browsers and proxies reuse it meanwhile
+    cacheControl = "public, max-age=300"
+
+    def __init__(self, data):
+        self.body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.etag = f'"{sha256(self.body).hexdigest()[:32]}"'
+        self.variants = {'gzip': gzip.compress(self.body, compresslevel=9)}
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(self.body)
+
+    @classmethod
+    def FromParts(cls, body: bytes, etag: str, variants: dict[str, bytes]) -> 'SerializedResponse':
+        '''Response that was already serialized and compressed elsewhere, e.g. read from a snapshot file'''
+        response = cls.__new__(cls)
+        response.body = body
+        response.etag = etag
+        response.variants = variants
+        return response
+
+    def Respond(self, request: Request) -> Response:
+        '''Serve the pre-serialized body, 304 if the client already has it'''
+        headers = {'ETag': self.etag, 'Cache-Control': self.cacheControl, 'Vary': 'Accept-Encoding'}
+
+        ifNoneMatch = request.headers.get('if-none-match')
+        if ifNoneMatch is not None:
+            tags = [tag.strip().removeprefix('W/') for tag in ifNoneMatch.split(',')]
+            if self.etag in tags or '*' in tags:
+                return Response(status_code=304, headers=headers)
+
+        # Prefer the smallest variant the client accepts
+        accepted = self.AcceptedEncodings(request.headers.get('accept-encoding', ''))
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in self.variants:
+                headers['Content-Encoding'] = encoding
+                return Response(self.variants[encoding], media_type='application/json', headers=headers)
+
+        return Response(self.body, media_type='application/json', headers=headers)
+
+    @staticmethod
+    def AcceptedEncodings(header: str) -> set[str]:
+        '''Encodings from an Accept-Encoding header, ignoring those explicitly refused with q=0'''
+        accepted = set()
+        for part in header.split(','):
+            encoding, _, params = part.strip().partition(';')
+            if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                continue
+            accepted.add(encoding.strip().lower())
+        return accepted
@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+from bisect import bisect_right
+
+class RollupCube():
+    '''Every data point per hour, day and week, precomputed once per refresh.
+       Only the hourly buckets come from the database, days and weeks are summed from them.'''
+    metrics = ('reqCount', 'activeCount', 'reqAmount', 'activeAmount', 'loansPaid', 'loansUnpaid',
+               'reqAmountUSD', 'activeAmountUSD')
+    buckets = ('hour', 'day', 'week')
+
+    def __init__(self, hourlyRows: list[tuple], until: datetime | None = None):
+        '''Build the cube from (hour, *metrics) rows as returned by Database.AggregateHourly'''
+        # Bucket start (epoch) -> metric sums, for each granularity
+        self.levels: dict[str, tuple[list[int], list[tuple]]] = {}
+
+        hours = {}
+        for row in hourlyRows:
+            hour = row[0] if isinstance(row[0], datetime) else datetime.fromisoformat(row[0])
+            hours[hour] = tuple(round(value, 2) if isinstance(value, float) else int(value) for value in row[1:])
+
+        if len(hours) == 0:
+            for bucket in self.buckets:
+                self.levels[bucket] = ([], [])
+            return
+
+        # Zero-fill every hour from the first Post until now, so ranges are continuous
+        first = min(hours)
+        last = max(max(hours), (until or datetime.now()).replace(minute=0, second=0, microsecond=0))
+        empty = (0,) * len(self.metrics)
+        hour = first
+        hourly = []
+        while hour <= last:
+            hourly.append((hour, hours.get(hour, empty)))
+            hour += timedelta(hours=1)
+
+        self.levels['hour'] = ([int(h.timestamp()) for h, _ in hourly], [m for _, m in hourly])
+        self.levels['day'] = self.Combine(hourly, lambda h: h.replace(hour=0))
+        self.levels['week'] = self.Combine(hourly, lambda h: h.replace(hour=0) - timedelta(days=h.weekday()))
+
+    @classmethod
+    def PerSubreddit(cls, hourlyRows: list[tuple], until: datetime | None = None) -> tuple['RollupCube', dict[str, 'RollupCube']]:
+        '''Build the combined cube and one cube per subreddit from (hour, subreddit, *metrics) rows
+           as returned by Database.AggregateHourly, the combined hours are the sums of their subreddits'''
+        until = until or datetime.now()
+        combined: dict = {}
+        subreddits: dict[str, list[tuple]] = {}
+        for hour, subreddit, *metrics in hourlyRows:
+            subreddits.setdefault(subreddit, []).append((hour, *metrics))
+            combined[hour] = [a + b for a, b in zip(combined[hour], metrics)] if hour in combined else metrics
+        cube = cls([(hour, *metrics) for hour, metrics in combined.items()], until)
+        # When only one subreddit is stored it is the combined cube
+        if len(subreddits) == 1:
+            return (cube, {subreddit: cube for subreddit in subreddits})
+        return (cube, {subreddit: cls(rows, until) for subreddit, rows in subreddits.items()})
+
+    @classmethod
+    def FromLevels(cls, levels: dict[str, list]) -> 'RollupCube':
+        '''Rebuild a cube from its levels, as stored in a snapshot file'''
+        cube = cls.__new__(cls)
+        cube.levels = {bucket: (list(starts), [tuple(s) for s in sums]) for bucket, (starts, sums) in levels.items()}
+        return cube
+
+    @staticmethod
+    def Combine(hourly: list[tuple[datetime, tuple]], bucketStart) -> tuple[list[int], list[tuple]]:
+        '''Sum consecutive hours into coarser buckets, bucketStart maps an hour to the start of its bucket'''
+        starts: list[int] = []
+        sums: list[list[int]] = []
+        for hour, metrics in hourly:
+            start = int(bucketStart(hour).timestamp())
+            if len(starts) == 0 or starts[-1] != start:
+                starts.append(start)
+                sums.append(list(metrics))
+            else:
+                sums[-1] = [a + b for a, b in zip(sums[-1], metrics)]
+        # Float sums pick up representation error while combining, keep them in cents
+        sums = [[round(value, 2) if isinstance(value, float) else value for value in s] for s in sums]
+        return (starts, [tuple(s) for s in sums])
+
+    def Query(self, start: int | None, end: int | None, bucket: str) -> list[dict]:
+        '''Buckets overlapping the epoch range [start, end], oldest first, in the same shape as the timeframe'''
+        starts, sums = self.levels[bucket]
+        first = 0 if start is None else max(bisect_right(starts, start) - 1, 0)
+        last = len(starts) if end is None else bisect_right(starts, end)
+
+        result = []
+        for i in range(first, last):
+            entry = {'date': starts[i]}
+            entry.update(zip(self.metrics, sums[i]))
+            result.append(entry)
+        return result
@@ -0,0 +1,13 @@
+from rollup import RollupCube
+from time import time
+
+class TimeframeSnapshot():
+    '''Everything a refresh produces for the API, built once and then only read'''
+    def __init__(self, timeframe: list[dict], cube: RollupCube, builtAt: float | None = None, roi: dict | None = None,
+                 subreddits: dict[str, RollupCube] | None = None):
+        self.timeframe = timeframe
+        self.cube = cube
+        # The same rollup per crawled subreddit, cube is every subreddit combined
+        self.subreddits = subreddits or {}
+        self.roi = roi or {}
+        self.builtAt = time() if builtAt is None else builtAt
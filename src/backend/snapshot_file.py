@@ -0,0 +1,114 @@
+from response_cache import SerializedResponse
+from snapshot import TimeframeSnapshot
+from rollup import RollupCube
+from threading import Lock
+from tempfile import gettempdir
+import struct
+import mmap
+import json
+import os
+import settings
+
+# File layout: magic, header length, JSON header, then the sections the header points to.
+# The timeframe is stored already serialized and compressed, so workers serve it without re-encoding.
+magic = b'LDVSNAP1'
+headerLength = struct.Struct('<I')
+
+def SnapshotPath() -> str:
+    '''Where the refresh job publishes snapshots, shared by every worker on this machine'''
+    return settings.Get().snapshotPath or os.path.join(gettempdir(), 'loan-data-visualizer.snapshot')
+
+def ReadHeader(path: str) -> dict | None:
+    '''Header of the snapshot file at path, None if there is no valid one'''
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(magic)) != magic:
+                return None
+            (length,) = headerLength.unpack(f.read(headerLength.size))
+            return json.loads(f.read(length))
+    except (OSError, ValueError, struct.error):
+        return None
+
+def WriteSnapshotFile(snapshot: TimeframeSnapshot, response: SerializedResponse, path: str | None = None) -> int:
+    '''Publish a snapshot atomically: write a temporary file next to it and rename it into place.
+       Returns the version of the new file, one higher than the one it replaces.'''
+    path = path or SnapshotPath()
+    previous = ReadHeader(path)
+    version = 1 if previous is None else previous['version'] + 1
+
+    sections = {'timeframe': response.body,
+                'cube': json.dumps(snapshot.cube.levels, separators=(',', ':')).encode('utf-8'),
+                'roi': json.dumps(snapshot.roi, separators=(',', ':')).encode('utf-8')}
+    for subreddit, cube in snapshot.subreddits.items():
+        sections[f'cube.{subreddit}'] = json.dumps(cube.levels, separators=(',', ':')).encode('utf-8')
+    for encoding, body in response.variants.items():
+        sections[f'timeframe.{encoding}'] = body
+
+    offset = 0
+    layout = {}
+    for name, body in sections.items():
+        layout[name] = (offset, len(body))
+        offset += len(body)
+    header = json.dumps({'version': version, 'builtAt': snapshot.builtAt, 'etag': response.etag,
+                         'sections': layout}).encode('utf-8')
+
+    tmpPath = f'{path}.{os.getpid()}.tmp'
+    with open(tmpPath, 'wb') as f:
+        f.write(magic)
+        f.write(headerLength.pack(len(header)))
+        f.write(header)
+        for body in sections.values():
+            f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmpPath, path)
+    return version
+
+class SnapshotFile():
+    '''Per-worker view of the published snapshot file, reloaded whenever a new version is renamed into place'''
+    def __init__(self, path: str | None = None):
+        self.path = path or SnapshotPath()
+        self.lock = Lock()
+        self.identity = None
+        self.version = None
+        self.published = None
+
+    def Current(self) -> tuple[TimeframeSnapshot, SerializedResponse] | None:
+        '''Latest published snapshot and response, None if nothing was published yet.
+           Checking for a new version costs a single stat call.'''
+        try: stat = os.stat(self.path)
+        except FileNotFoundError: return self.published
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if identity != self.identity:
+            with self.lock:
+                if identity != self.identity:
+                    try: self.Load()
+                    except (OSError, ValueError, KeyError, struct.error) as e:
+                        # Keep serving the previous version rather than failing requests
+                        print(f"Ignoring invalid snapshot file {self.path}: {e!r}")
+                        self.identity = identity
+        return self.published
+
+    def Load(self) -> None:
+        '''Map the file and decode it, the file is never modified in place so no locking is needed'''
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            stat = os.fstat(f.fileno())
+            identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if mm[:len(magic)] != magic:
+                raise ValueError("not a snapshot file")
+            start = len(magic) + headerLength.size
+            (length,) = headerLength.unpack(mm[len(magic):start])
+            header = json.loads(mm[start:start + length])
+            base = start + length
+            sections = {name: mm[base + offset:base + offset + size] for name, (offset, size) in header['sections'].items()}
+
+        variants = {name.removeprefix('timeframe.'): body for name, body in sections.items() if name.startswith('timeframe.')}
+        response = SerializedResponse.FromParts(sections['timeframe'], header['etag'], variants)
+        subreddits = {name.removeprefix('cube.'): RollupCube.FromLevels(json.loads(body))
+                      for name, body in sections.items() if name.startswith('cube.')}
+        snapshot = TimeframeSnapshot(json.loads(sections['timeframe']), RollupCube.FromLevels(json.loads(sections['cube'])),
+                                     header['builtAt'], json.loads(sections['roi']) if 'roi' in sections else None,
+                                     subreddits)
+        self.published = (snapshot, response)
+        self.version = header['version']
+        self.identity = identity
@@ -0,0 +1,66 @@
+from statistics import median
+import subprocess
+import argparse
+import json
+import sys
+
+# Cold-start benchmark of the API server, e.g.
+#   python startup_benchmark.py --runs 10
+# Every run is a fresh interpreter that imports api_server and serves /get-timeframe once, like a new worker would.
+# Run it from the directory the server runs in, api_server needs its .env.
+
+# Modules a worker serving cached data should not need to import
+heavyModules = ('loan_data_visualizer', 'reddit_api', 'db_api', 'psycopg', 'psycopg_pool', 'sqlite3', 'httpx', 'numpy')
+
+probe = f'''
+from time import perf_counter
+started = perf_counter()
+import api_server
+imported = perf_counter()
+from starlette.requests import Request
+response = api_server.GetTimeframe(Request({{'type': 'http', 'method': 'GET', 'path': '/get-timeframe', 'headers': []}}))
+served = perf_counter()
+import resource, json, sys
+print(json.dumps({{'importSeconds': imported - started,
+                  'firstResponseSeconds': served - imported,
+                  'status': response.status_code,
+                  'maxRssKiB': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  'modules': len(sys.modules),
+                  'heavy': [name for name in {heavyModules!r} if name in sys.modules]}}))
+'''
+
+def Run() -> dict:
+    '''One cold start in a fresh interpreter'''
+    result = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(f"api_server could not start:\n{result.stdout}{result.stderr}")
+    return json.loads(result.stdout.splitlines()[-1])
+
+def ImportTimes(top: int) -> list[tuple[int, str]]:
+    '''Slowest modules by cumulative import time, from python -X importtime'''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import api_server'], capture_output=True, text=True)
+    times = []
+    for line in result.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            times.append((int(parts[1]), parts[2].strip()))
+    return sorted(times, reverse=True)[:top]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time how long a fresh api_server worker takes to serve cached data')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--top', type=int, default=0, help='also list the N slowest imports')
+    args = parser.parse_args()
+
+    runs = [Run() for _ in range(args.runs)]
+    print(f"api_server cold start, median of {args.runs} runs")
+    print(f"  import          {median(r['importSeconds'] for r in runs) * 1000:>8.1f} ms")
+    print(f"  first response  {median(r['firstResponseSeconds'] for r in runs) * 1000:>8.1f} ms (status {runs[0]['status']})")
+    print(f"  max RSS         {median(r['maxRssKiB'] for r in runs) / 1024:>8.1f} MiB")
+    print(f"  modules         {runs[0]['modules']:>8}")
+    print(f"  heavy modules   {', '.join(runs[0]['heavy']) or 'none'}")
+
+    if args.top:
+        print(f"\nslowest imports (cumulative)")
+        for microseconds, name in ImportTimes(args.top):
+            print(f"  {microseconds / 1000:>8.1f} ms  {name}")
@@ -0,0 +1,82 @@
+import os
+import random
+from datetime import datetime, timedelta
+import psycopg
+import pytest
+from psycopg_pool import ConnectionPool
+import db_api
+from models import PostBatch
+
+# DailyStats is kept up to date by triggers, it must always match aggregating Posts directly.
+# Postgres runs when POSTGRES_URL points at a server, e.g. postgresql://postgres:@/mydb?host=/tmp/pgdata
+
+days = 40
+
+@pytest.fixture(params=['sqlite', 'postgres', 'postgres partitioned'])
+def db(request, tmp_path, monkeypatch):
+    if request.param == 'sqlite':
+        monkeypatch.setattr(db_api, 'SQLitePath', lambda: str(tmp_path / 'loan-db'))
+        db_api.UseSQLite()
+    else:
+        url = os.getenv('POSTGRES_URL')
+        if not url:
+            pytest.skip('POSTGRES_URL is not set')
+        try: psycopg.connect(url).close()
+        except psycopg.OperationalError:
+            pytest.skip('Postgres can not be reached')
+        monkeypatch.setattr(db_api, 'pool', ConnectionPool(url, min_size=1, max_size=2, open=True))
+
+    database = db_api.Database()
+    database.CreateTables(wipe=False, partitioned=request.param == 'postgres partitioned')
+    yield database
+    database.CloseConnection()
+    db_api.ClosePool()
+
+def Batch(count: int, seed: int, subreddit: str = 'borrow') -> PostBatch:
+    '''Posts of every status and currency spread over the last days, some with a known isActive'''
+    rng = random.Random(seed)
+    titles = ['[REQ] (${0}) - #Austin, TX, USA - Repay ${0} on 12/01', '[REQ] (£{0}) - #Leeds, UK',
+              '[REQ] (€{0}) - #Berlin, Germany (ARRANGED)', '[REQ] (${0} CAD) - #Toronto, ON, Canada',
+              '[PAID] (u/lender) (${0}) - on time', '[UNPAID] (u/lender) - €{0} due 15th', '[LATE] (£{0}) - 2nd',
+              '[META] Loan bot is down']
+    posts = PostBatch(subreddit)
+    now = datetime.now()
+    for i in range(count):
+        created = now - timedelta(days=rng.uniform(0, days + 5))
+        posts.Append(f'{subreddit[:2]}{seed}{i:04d}', rng.choice(titles).format(rng.randint(5, 2000)),
+                     created.timestamp(), rng.choice([0, 0, 1, 4]))
+    return posts
+
+def AssertMatches(db: db_api.Database) -> None:
+    expected, actual = db.AggregateTimeframe(days), db.GetDailyStats(days)
+    assert len(actual) == days
+    for expectedRow, actualRow in zip(expected, actual):
+        assert actualRow[:7] == expectedRow[:7]
+        assert actualRow[7:] == pytest.approx(expectedRow[7:])
+
+def test_daily_stats_follow_inserts_updates_and_deletes(db):
+    db.InsertPostList(Batch(600, 1))
+    db.UpsertPostList(Batch(300, 2, 'lending'))
+    AssertMatches(db)
+
+    # Validation results, Posts changing state and Posts removed by Reddit
+    db.UpdateActiveOnLoanMany([(id, i % 3 == 0) for i, id in enumerate(db.GetNullActiveLoanRequests())])
+    db.UpsertPostList(Batch(300, 2, 'lending'))
+    db.cur.execute("DELETE FROM Posts WHERE amount < 100")
+    db.conn.commit()
+    AssertMatches(db)
+
+    # The USD amounts depend on the currency, nothing rewrites it today but the rollup must follow it
+    db.cur.execute("UPDATE Posts SET currency = 'GBP' WHERE currency = 'USD'")
+    db.conn.commit()
+    AssertMatches(db)
+
+    # Anonymizing rewrites ids and titles, the rollup must not move
+    db.AnonymizeData(keepIds=True)
+    AssertMatches(db)
+
+def test_daily_stats_seeded_from_stored_posts(db):
+    db.InsertPostList(Batch(600, 3))
+    db.CreateDailyStats()
+    db.conn.commit()
+    AssertMatches(db)
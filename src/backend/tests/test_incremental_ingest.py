@@ -0,0 +1,60 @@
+import tempfile
+from time import time
+import pytest
+import db_api
+import fake_reddit
+import settings
+from loan_data_visualizer import UpdateTimeframeSnapshot
+from models import PostKey
+
+# Incremental runs only crawl Posts near the high-water mark again, which must still catch loans given later
+
+@pytest.fixture
+def reddit(tmp_path, monkeypatch):
+    '''Fake r/borrow with 200 Posts over 5 days, and a fresh SQLite database and settings pointing at both'''
+    server = fake_reddit.Start()
+    server.subreddits['borrow'] = fake_reddit.FakeSubreddit(200, days=5.0)
+    config = settings.Settings(loadEnvFile=False)
+    config.requireEnvFile = False
+    config.redditCredentials = {key: 'test' for key in config.redditCredentials}
+    config.redditAuthURL = config.redditAPIURL = server.url
+    config.subreddits = ['borrow']
+    config.commentCachePath = str(tmp_path / 'comment-cache.db')
+    config.archiveDir = str(tmp_path / 'archive')
+    monkeypatch.setattr(settings, 'current', config)
+    # Crawl cursors are kept in the temporary directory
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    monkeypatch.setattr(db_api, 'SQLitePath', lambda: str(tmp_path / 'loan-db'))
+    db_api.UseSQLite()
+    yield server.Subreddit('borrow')
+    server.shutdown()
+    db_api.ClosePool()
+
+def PostNewer(subreddit: fake_reddit.FakeSubreddit, count: int) -> None:
+    '''Posts made since the last crawl, on top of the listing'''
+    now = time()
+    ids = [fake_reddit.Base36(36**6 + len(subreddit.posts) + i) for i in range(count)]
+    subreddit.posts[:0] = [{'id': id, 'name': f't3_{id}', 'title': '[META] Weekly discussion thread',
+                            'created': now - i * 0.01, 'created_utc': now - i * 0.01, 'num_comments': 0,
+                            'author': 'user1'} for i, id in enumerate(ids)]
+    subreddit.index = {post['id']: i for i, post in enumerate(subreddit.posts)}
+
+def StoredActive(id: str) -> bool | None:
+    with db_api.Database() as db:
+        db.cur.execute("SELECT isactive FROM Posts WHERE id = ?", (PostKey(id),))
+        return db.cur.fetchone()[0]
+
+def test_loan_given_after_first_crawl_is_found(reddit):
+    # A request two days old, with only the bot's comments when first crawled
+    post = next(post for post in reddit.posts[80:] if post['title'].startswith('[REQ]'))
+    post['num_comments'] = 2
+    reddit.active.discard(post['id'])
+    UpdateTimeframeSnapshot(incremental=True)
+    assert StoredActive(post['id']) == 0
+
+    # A lender comments, and enough new Posts come in that it is no longer on the pages reaching the high-water mark
+    post['num_comments'] = 5
+    reddit.active.add(post['id'])
+    PostNewer(reddit, 150)
+    UpdateTimeframeSnapshot(incremental=True)
+    assert StoredActive(post['id']) == 1
@@ -0,0 +1,37 @@
+import pickle
+import metrics
+from metrics import Counter, Gauge, Histogram
+
+# Crawl workers record metrics in their own process, the coordinator merges them into the served ones
+
+def Registry(monkeypatch) -> tuple[Counter, Histogram, Gauge]:
+    '''The same metrics as another process would have them, in a registry of their own'''
+    monkeypatch.setattr(metrics, 'registry', [])
+    return (Counter('requests_total', 'Requests', ('endpoint',)), Histogram('stage_seconds', 'Stages', ('stage',)),
+            Gauge('remaining', 'Quota left'))
+
+def test_merge_adds_a_worker_snapshot(monkeypatch):
+    counter, histogram, gauge = Registry(monkeypatch)
+    counter.Inc(2, endpoint='new')
+    histogram.Observe(0.2, stage='crawl')
+    gauge.Set(50)
+    served = metrics.registry
+
+    workerCounter, workerHistogram, workerGauge = Registry(monkeypatch)
+    workerCounter.Inc(3, endpoint='new')
+    workerCounter.Inc(endpoint='comments')
+    workerHistogram.Observe(4.0, stage='crawl')
+    workerHistogram.Observe(1.0, stage='validate')
+    workerGauge.Set(20)
+    snapshot = pickle.loads(pickle.dumps(metrics.Snapshot(clear=True)))
+    # Cleared, so a reused worker only hands back what it recorded afterwards
+    assert metrics.Snapshot() == {'requests_total': {}, 'stage_seconds': {}, 'remaining': {}}
+
+    monkeypatch.setattr(metrics, 'registry', served)
+    metrics.Merge(snapshot)
+    assert counter.values == {('new',): 5, ('comments',): 1}
+    assert gauge.values == {(): 20}
+    crawl = histogram.values[('crawl',)]
+    assert (crawl[-2], crawl[-1]) == (4.2, 2)
+    assert crawl[histogram.buckets.index(0.25)] == 1 and crawl[histogram.buckets.index(5.0)] == 1
+    assert histogram.values[('validate',)][-1] == 1
@@ -0,0 +1,29 @@
+import json
+import os
+import pytest
+from models import ParseTitle, ParseTitles, Status, Currency
+
+# Real-shaped r/borrow titles with the result of the original Post parser, which ParseTitle must keep giving
+corpusPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'titles.json')
+with open(corpusPath, encoding='utf-8') as f:
+    corpus = json.load(f)
+
+def Expected(case: dict) -> tuple:
+    return (Status[case['status']], Currency[case['currency']], case['amount'], case['isActive'])
+
+@pytest.mark.parametrize('case', corpus, ids=[case['title'][:40] for case in corpus])
+def test_parse_title_matches_corpus(case):
+    assert ParseTitle(case['title'], case['comments']) == Expected(case)
+
+def test_parse_titles_matches_corpus():
+    titles = [case['title'] for case in corpus]
+    comments = [case['comments'] for case in corpus]
+    assert ParseTitles(titles, comments) == [Expected(case) for case in corpus]
+
+def test_parse_titles_without_comment_counts():
+    titles = [case['title'] for case in corpus]
+    assert ParseTitles(titles) == [ParseTitle(title) for title in titles]
+
+def test_corpus_covers_every_status_and_currency():
+    assert {case['status'] for case in corpus} == {s.name for s in Status}
+    assert {case['currency'] for case in corpus} == {c.name for c in Currency}
@@ -0,0 +1,52 @@
+import json
+from threading import Event
+import pytest
+import refresh_job
+from refresh_job import RefreshJob
+
+# Every server process has its own RefreshJob, all of them must report the refresh any one of them runs
+
+pytestmark = pytest.mark.skipif(refresh_job.fcntl is None, reason='refresh lock needs fcntl')
+
+@pytest.fixture
+def workers(tmp_path):
+    '''Two server processes sharing the lock and status files, flock also excludes open files within one process'''
+    jobs = [RefreshJob(), RefreshJob()]
+    for job in jobs:
+        job.lockPath = str(tmp_path / 'refresh.lock')
+        job.statusPath = str(tmp_path / 'refresh.json')
+    yield jobs
+    for job in jobs:
+        job.Shutdown()
+
+def test_status_reports_a_refresh_of_another_process(workers):
+    running, other = workers
+    stage, release = Event(), Event()
+    def Job(progress):
+        progress('crawl', 2, 5)
+        stage.set()
+        release.wait(5)
+        return 1
+    finished = Event()
+    assert running.Start(Job, lambda result: finished.set())
+    stage.wait(5)
+
+    # The other process can not start one, and says why
+    assert not other.Start(Job, lambda result: None)
+    status = other.Status()
+    assert (status['state'], status['stage'], status['done'], status['total']) == ('running', 'crawl', 2, 5)
+    assert status['startedAt'] == running.startedAt
+
+    release.set()
+    finished.wait(5)
+    running.Shutdown()
+    status = other.Status()
+    assert status['state'] == 'idle' and status['lastError'] is None
+    assert status['lastDuration'] == running.lastDuration and status['lastDuration'] is not None
+
+def test_status_of_a_refresh_whose_process_exited(workers, tmp_path):
+    _, other = workers
+    with open(tmp_path / 'refresh.json', 'w') as f:
+        json.dump(other.LocalStatus() | {'state': 'running', 'stage': 'validate'}, f)
+    status = other.Status()
+    assert status['state'] == 'failed' and status['stage'] == 'validate'
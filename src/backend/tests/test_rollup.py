@@ -0,0 +1,32 @@
+from datetime import datetime
+from rollup import RollupCube
+
+# The combined cube sums the subreddits of each hour, it must match a cube built from the combined rows
+until = datetime(2026, 10, 3, 12)
+rows = [(datetime(2026, 10, 1, 9), 'borrow', 2, 1, 300, 100, 0, 1, 300.5, 100.25),
+        (datetime(2026, 10, 1, 9), 'lending', 1, 0, 50, 0, 1, 0, 62.5, 0.0),
+        (datetime(2026, 10, 2, 17), 'lending', 3, 2, 900, 400, 2, 0, 1100.1, 480.2),
+        ('2026-10-03 08:00:00', 'borrow', 1, 1, 20, 20, 0, 0, 20.0, 20.0)]
+
+def test_per_subreddit_cubes_sum_to_combined():
+    cube, cubes = RollupCube.PerSubreddit(rows, until)
+    combined = RollupCube([(datetime(2026, 10, 1, 9), 3, 1, 350, 100, 1, 1, 363.0, 100.25),
+                           (datetime(2026, 10, 2, 17), 3, 2, 900, 400, 2, 0, 1100.1, 480.2),
+                           ('2026-10-03 08:00:00', 1, 1, 20, 20, 0, 0, 20.0, 20.0)], until)
+    assert cube.levels == combined.levels
+    assert sorted(cubes) == ['borrow', 'lending']
+    assert cubes['lending'].Query(None, None, 'week') == RollupCube([row[:1] + row[2:] for row in rows[1:3]], until).Query(None, None, 'week')
+    for bucket in RollupCube.buckets:
+        for i, sums in enumerate(cube.levels[bucket][1]):
+            parts = [c.Query(cube.levels[bucket][0][i], cube.levels[bucket][0][i], bucket) for c in cubes.values()]
+            for j, metric in enumerate(RollupCube.metrics):
+                total = sum(entry[metric] for part in parts for entry in part if entry['date'] == cube.levels[bucket][0][i])
+                assert round(total, 2) == sums[j]
+
+def test_single_subreddit_is_the_combined_cube():
+    cube, cubes = RollupCube.PerSubreddit([row for row in rows if row[1] == 'borrow'], until)
+    assert cubes == {'borrow': cube}
+
+def test_no_posts():
+    cube, cubes = RollupCube.PerSubreddit([], until)
+    assert cubes == {} and cube.Query(None, None, 'day') == []